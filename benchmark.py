@@ -0,0 +1,287 @@
+# benchmark.py
+# ------------
+# Licensing Information:  You are free to use or extend these projects for
+# educational purposes provided that (1) you do not distribute or publish
+# solutions, (2) you retain this notice, and (3) you provide clear
+# attribution to UC Berkeley, including a link to http://ai.berkeley.edu.
+#
+# Attribution Information: The Pacman AI projects were developed at UC Berkeley.
+# The core projects and autograders were primarily created by John DeNero
+# (denero@cs.berkeley.edu) and Dan Klein (klein@cs.berkeley.edu).
+# Student side autograding was added by Brad Miller, Nick Hay, and
+# Pieter Abbeel (pabbeel@cs.berkeley.edu).
+
+
+"""
+Benchmark.py times the hot paths of the forward model and its data
+structures on a small, a medium and a large layout, and how the cost of a
+forward model step grows with the number of ghosts (on generated open
+layouts with 4 to 256 ghosts):
+
+  python benchmark.py                   # run everything, compare, record
+  python benchmark.py -b Grid           # only the benchmarks matching 'Grid'
+  python benchmark.py --noRecord        # compare without recording
+  python benchmark.py --sizes 50,200,1000
+
+--sizes adds scaling benchmarks: the forward model, the grids and the
+agents on mazes of each size made by layoutGenerator.py.
+
+Every benchmark reports the best of several repeats in microseconds per
+call, which is much more stable than the mean.  Each run is appended to a
+JSON history file together with the current git commit, and compared
+against the median of the last HISTORY_WINDOW runs in that file, so one
+noisy run does not cause false alarms: anything that got slower by more
+than the threshold is flagged and makes the exit status 1.
+"""
+
+import pacman, layout, util
+from game import Actions
+from game import Directions
+from game import reconstituteGrid
+from game import Grid
+from game import BudgetScheduler
+from game import GameContext
+from heuristics import nearestFoodHeuristic
+import sys, os, time, timeit, random, math
+
+LAYOUTS = [('small', 'smallClassic'), ('medium', 'mediumClassic'), ('large', 'originalClassic')]
+WARMUP_MOVES = 20 # moves played before timing, so states are not pristine
+GHOST_COUNTS = [4, 16, 64, 256]
+SCALING_ITERATIONS = 100 # forward model calls per agent move in the scaling benchmarks
+HISTORY_WINDOW = 5 # earlier runs whose median results are the baseline
+
+def default(str):
+    return str + ' [Default: %default]'
+
+def midGameState( board ):
+    """
+    The state reached from the start of the layout board after a fixed
+    sequence of random Pacman moves (with random ghosts), so food has been
+    eaten and agents have moved.
+    """
+    state = pacman.GameState()
+    state.initialize( board, 4 )
+    state.setRandom( util.RandomStream( 0 ) )
+    rng = random.Random( 0 )
+    for i in range( WARMUP_MOVES ):
+        successor = state.generatePacmanSuccessor( rng.choice( state.getLegalPacmanActions() ) )
+        if successor.isWin() or successor.isLose(): break
+        state = successor
+    return state
+
+def crowdedLayout( numGhosts ):
+    """
+    An open walled room with numGhosts ghosts on every other cell of its
+    upper rows and Pacman a few rows below them.
+    """
+    inner = max( 9, 2 * int( math.sqrt( numGhosts ) ) + 1 )
+    perRow = (inner + 1) / 2
+    rows = []
+    for row in range( (numGhosts + perRow - 1) / perRow ):
+        ghosts = min( perRow, numGhosts - row * perRow )
+        rows.append( ('G.' * ghosts + '.' * inner)[:inner] )
+        rows.append( '.' * inner )
+    rows += ['.' * inner] * 4
+    rows.append( '.' * (inner / 2) + 'P' + '.' * (inner - inner / 2 - 1) )
+    rows.append( '.' * inner )
+    return layout.Layout( ['%' * (inner + 2)] + ['%' + row + '%' for row in rows] + ['%' * (inner + 2)] )
+
+def ghostScalingBenchmarks( numGhosts ):
+    state = pacman.GameState()
+    state.initialize( crowdedLayout( numGhosts ), numGhosts )
+    state.setRandom( util.RandomStream( 0 ) )
+    action = state.getLegalPacmanActions()[0]
+    return [('GameState.generateSuccessor(pacman)', lambda: state.generateSuccessor( 0, action )),
+            ('GameState.generatePacmanSuccessor', lambda: state.generatePacmanSuccessor( action ))]
+
+def forwardModelBenchmarks( state ):
+    action = state.getLegalPacmanActions()[0]
+    ghostAction = state.getLegalActions( 1 )[0]
+    other = state.deepCopy()
+    data = state.data
+    return [('GameState.generateSuccessor(pacman)', lambda: state.generateSuccessor( 0, action )),
+            ('GameState.generateSuccessor(ghost)', lambda: state.generateSuccessor( 1, ghostAction )),
+            ('GameState.generatePacmanSuccessor', lambda: state.generatePacmanSuccessor( action )),
+            ('GameState.deepCopy', state.deepCopy),
+            ('GameStateData.__hash__', data.__hash__),
+            ('GameStateData.__eq__', lambda: data == other.data)]
+
+def gridBenchmarks( state ):
+    food = state.getFood()
+    walls = state.getWalls()
+    packed = food.packBits()
+    packedBytes = food.packBytes()
+    return [('Grid.copy', food.copy),
+            ('Grid.count', food.count),
+            ('Grid.asList', food.asList),
+            ('Grid.packBits', food.packBits),
+            ('reconstituteGrid', lambda: reconstituteGrid( packed )),
+            ('Grid.packBytes', food.packBytes),
+            ('Grid.fromBytes', lambda: Grid.fromBytes( packedBytes, food.width, food.height )),
+            ('Actions.getPossibleActions', lambda: Actions.getPossibleActions( state.data.agentStates[0].configuration, walls )),
+            ('FoodIndex.getNearest', lambda: state.getFoodIndex().getNearest( state.getPacmanPosition(), walls )),
+            ('nearestFoodHeuristic', lambda: nearestFoodHeuristic( state ))]
+
+def agentBenchmarks( state, iterations ):
+    """
+    A move of each kind of agent in state, Pacman's with a budget of
+    iterations forward model calls.
+    """
+    import pacmanAgents, ghostAgents
+    agentState = pacman.GameState( state )
+    budget = BudgetScheduler( iterations )
+    agentState.data.context = GameContext( budget, util.RandomStream( 0 ) )
+    benchmarks = []
+    for agent in [pacmanAgents.MCTSAgent(), pacmanAgents.RandomAgent()]:
+        agent.registerInitialState( agentState )
+        def move( agent=agent ):
+            budget.startMove( agentState )
+            agent.getAction( agentState )
+            budget.endMove()
+        benchmarks.append( ('%s.getAction' % agent.__class__.__name__, move) )
+    for ghost in [ghostAgents.RandomGhost( 1 ), ghostAgents.DirectionalGhost( 1 )]:
+        benchmarks.append( ('%s.getAction' % ghost.__class__.__name__, lambda ghost=ghost: ghost.getAction( agentState )) )
+    return benchmarks
+
+def scalingBenchmarks( size ):
+    """
+    The forward model, grid and agent benchmarks on a generated size x size
+    maze with four ghosts.
+    """
+    import layoutGenerator
+    state = midGameState( layoutGenerator.generateLayout( size, size, 0, ghosts=1.0, maxGhosts=4 ) )
+    return forwardModelBenchmarks( state ) + gridBenchmarks( state ) + agentBenchmarks( state, SCALING_ITERATIONS )
+
+def counterBenchmarks():
+    counter = util.Counter()
+    for i, key in enumerate( [Directions.NORTH, Directions.SOUTH, Directions.EAST, Directions.WEST] ):
+        counter[key] = i + 1
+    # normalizing the normalized counter again does the same work, so one
+    # copy made up front serves every call and no copying is timed
+    normalized = counter.copy()
+    return [('Counter.normalize', normalized.normalize)]
+
+def allBenchmarks( sizes=[] ):
+    """
+    Returns (name, size, callable) for every benchmark, with the scaling
+    benchmarks of the given maze sizes.
+    """
+    benchmarks = []
+    for size, layoutName in LAYOUTS:
+        state = midGameState( layout.getLayout( layoutName ) )
+        for name, function in forwardModelBenchmarks( state ) + gridBenchmarks( state ):
+            benchmarks.append( (name, size, function) )
+    for numGhosts in GHOST_COUNTS:
+        for name, function in ghostScalingBenchmarks( numGhosts ):
+            benchmarks.append( (name, '%d ghosts' % numGhosts, function) )
+    for size in sizes:
+        for name, function in scalingBenchmarks( size ):
+            benchmarks.append( (name, 'maze %d' % size, function) )
+    for name, function in counterBenchmarks():
+        benchmarks.append( (name, '-', function) )
+    return benchmarks
+
+def timeFunction( function, repeat, budget ):
+    """
+    Microseconds per call of function: the best of repeat runs, each long
+    enough to take about budget seconds.
+    """
+    timer = timeit.Timer( function )
+    number = 1
+    while timer.timeit( number ) < budget / 10.0 and number < 10 ** 7:
+        number *= 10
+    number = max( 1, int( number * budget / max( timer.timeit( number ), 1e-9 ) ) )
+    return 1e6 * min( timer.repeat( repeat, number ) ) / number
+
+def runBenchmarks( pattern=None, repeat=5, budget=0.1, sizes=[] ):
+    results = {}
+    for name, size, function in allBenchmarks( sizes ):
+        key = '%s [%s]' % (name, size)
+        if pattern != None and pattern not in key: continue
+        results[key] = timeFunction( function, repeat, budget )
+        print '%-50s %12.2f us' % (key, results[key])
+    return results
+
+def gitCommit():
+    try:
+        import subprocess
+        return subprocess.Popen( ['git', 'rev-parse', '--short', 'HEAD'], stdout=subprocess.PIPE,
+                                 stderr=subprocess.PIPE ).communicate()[0].strip()
+    except Exception:
+        return None
+
+def loadHistory( fileName ):
+    import json
+    if not os.path.exists( fileName ): return []
+    f = open( fileName )
+    try: return json.load( f )
+    finally: f.close()
+
+def saveHistory( fileName, history ):
+    import json
+    f = open( fileName, 'w' )
+    try: json.dump( history, f, indent=1, sort_keys=True )
+    finally: f.close()
+
+def medianResults( runs ):
+    "The median time of every benchmark over the results of runs."
+    times = {}
+    for run in runs:
+        for key, value in run['results'].items():
+            times.setdefault( key, [] ).append( value )
+    medians = {}
+    for key, values in times.items():
+        values.sort()
+        middle = len(values) / 2
+        if len(values) % 2 == 1: medians[key] = values[middle]
+        else: medians[key] = (values[middle - 1] + values[middle]) / 2.0
+    return medians
+
+def findRegressions( previous, results, threshold ):
+    """
+    Prints the benchmarks that got slower than in previous by more than
+    threshold (relative) and returns how many did.
+    """
+    regressions = 0
+    for key in sorted( results ):
+        if key not in previous: continue
+        change = results[key] / previous[key] - 1
+        if change > threshold:
+            regressions += 1
+            print 'REGRESSION %-50s %10.2f -> %10.2f us (%+.0f%%)' % (key, previous[key], results[key], 100 * change)
+    return regressions
+
+def readCommand( argv ):
+    from optparse import OptionParser
+    usageStr = """
+    USAGE:      python benchmark.py <options>
+    """
+    parser = OptionParser(usageStr)
+    parser.add_option('-b', '--benchmark', dest='pattern', help='Only run benchmarks whose name contains this', default=None)
+    parser.add_option('--repeat', dest='repeat', type='int', help=default('Timing repeats per benchmark'), default=5)
+    parser.add_option('--budget', dest='budget', type='float', help=default('Seconds per timing repeat'), default=0.1)
+    parser.add_option('--history', dest='history', help=default('JSON file that keeps the results of earlier runs'), default='benchmark-history.json')
+    parser.add_option('--threshold', dest='threshold', type='float', help=default('Relative slowdown reported as a regression'), default=0.1)
+    parser.add_option('--noRecord', action='store_false', dest='record', help='Do not append this run to the history', default=True)
+    parser.add_option('--sizes', dest='sizes', help='Comma separated sizes of generated mazes to run the scaling benchmarks on', default=None)
+    options, otherjunk = parser.parse_args(argv)
+    if len(otherjunk) != 0:
+        raise Exception('Command line input not understood: ' + str(otherjunk))
+    return options
+
+if __name__ == '__main__':
+    options = readCommand( sys.argv[1:] )
+    sizes = []
+    if options.sizes != None: sizes = [int( size ) for size in options.sizes.split( ',' )]
+    results = runBenchmarks( options.pattern, options.repeat, options.budget, sizes )
+    history = loadHistory( options.history )
+    regressions = 0
+    if len(history) > 0:
+        runs = history[-HISTORY_WINDOW:]
+        regressions = findRegressions( medianResults( runs ), results, options.threshold )
+        print '%d regression(s) against the median of the %d run(s) since %s (commit %s)' % \
+              (regressions, len(runs), runs[0]['time'], runs[0]['commit'])
+    if options.record:
+        history.append( {'time': time.strftime( '%Y-%m-%d %H:%M:%S' ), 'commit': gitCommit(), 'results': results} )
+        saveHistory( options.history, history )
+    if regressions > 0: sys.exit(1)
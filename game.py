@@ -21,7 +21,8 @@
 # For more info, see http://inst.eecs.berkeley.edu/~cs188/sp09/pacman.html
 
 from util import *
-import time, os
+import time, os, random, copy, bisect
+import itertools, string, binascii
 import traceback
 import sys
 
@@ -35,7 +36,13 @@ class Agent:
     following methods which will be called if they exist:
 
     def registerInitialState(self, state): # inspects the starting state
+
+    The states an agent receives share their agent states, food grid and
+    layout with the running game.  An agent that modifies them in place should
+    set copyObservations = True to be handed a private deep copy instead.
     """
+    copyObservations = False
+
     def __init__(self, index=0):
         self.index = index
 
@@ -173,7 +180,7 @@ class Grid:
 
         self.width = width
         self.height = height
-        self.data = [[initialValue for y in range(height)] for x in range(width)]
+        self.data = [[initialValue] * height for x in range(width)]
         if bitRepresentation:
             self._unpackBits(bitRepresentation)
 
@@ -203,18 +210,35 @@ class Grid:
                 base *= 2
         return hash(h)
 
-    def copy(self):
-        g = Grid(self.width, self.height)
-        g.data = [x[:] for x in self.data]
+    def _withData(self, data):
+        """
+        A grid of the same size and settings holding data; nothing else
+        set on this grid is carried over to it.
+        """
+        g = Grid(0, 0)
+        g.width = self.width
+        g.height = self.height
+        g.CELLS_PER_INT = self.CELLS_PER_INT
+        g.data = data
         return g
 
+    def copy(self):
+        return self._withData([x[:] for x in self.data])
+
     def deepCopy(self):
         return self.copy()
 
     def shallowCopy(self):
-        g = Grid(self.width, self.height)
-        g.data = self.data
-        return g
+        return self._withData(self.data)
+
+    def copyColumn(self, x):
+        """
+        Returns a copy that shares every column but x with this grid, so
+        cells of column x can be changed without copying the others.
+        """
+        data = self.data[:]
+        data[x] = self.data[x][:]
+        return self._withData(data)
 
     def count(self, item =True ):
         return sum([x.count(item) for x in self.data])
@@ -231,18 +255,18 @@ class Grid:
         Returns an efficient int list representation
 
         (width, height, bitPackedInts...)
+
+        The cells are taken column by column, CELLS_PER_INT to an int with
+        the first one in the highest bit.  Each int is converted from a run
+        of '0' and '1' characters in one call instead of cell by cell.
         """
         bits = [self.width, self.height]
-        currentInt = 0
-        for i in range(self.height * self.width):
-            bit = self.CELLS_PER_INT - (i % self.CELLS_PER_INT) - 1
-            x, y = self._cellIndexToPosition(i)
-            if self[x][y]:
-                currentInt += 2 ** bit
-            if (i + 1) % self.CELLS_PER_INT == 0:
-                bits.append(currentInt)
-                currentInt = 0
-        bits.append(currentInt)
+        cells = str(bytearray(itertools.chain.from_iterable(self.data))).translate(_CELL_CHARS)
+        size = self.CELLS_PER_INT
+        for start in range(0, len(cells), size):
+            chunk = cells[start:start + size]
+            bits.append(int(chunk, 2) << (size - len(chunk)))
+        if len(cells) % size == 0: bits.append(0)
         return tuple(bits)
 
     def _cellIndexToPosition(self, index):
@@ -254,25 +278,130 @@ class Grid:
         """
         Fills in data from a bit-level representation
         """
-        cell = 0
+        size = self.CELLS_PER_INT
+        numCells = self.width * self.height
         for packed in bits:
-            for bit in self._unpackInt(packed, self.CELLS_PER_INT):
-                if cell == self.width * self.height: break
-                x, y = self._cellIndexToPosition(cell)
-                self[x][y] = bit
-                cell += 1
-
-    def _unpackInt(self, packed, size):
-        bools = []
-        if packed < 0: raise ValueError, "must be a positive integer"
-        for i in range(size):
-            n = 2 ** (self.CELLS_PER_INT - i - 1)
-            if packed >= n:
-                bools.append(True)
-                packed -= n
-            else:
-                bools.append(False)
-        return bools
+            if packed < 0: raise ValueError, "must be a positive integer"
+        cells = ''.join([format(packed, '0%db' % size) for packed in bits])[:numCells]
+        if len(cells) < numCells and numCells > 0:
+            # Cells the representation does not cover keep the initial value
+            cells += '01'[bool(self.data[0][0])] * (numCells - len(cells))
+        values = map(_CHAR_CELLS.__getitem__, cells)
+        height = self.height
+        self.data = [values[x * height:(x + 1) * height] for x in range(self.width)]
+
+    def packBytes(self):
+        """
+        Returns the cells as a string of (height + 7) / 8 bytes per column,
+        lowest bit first.  Unlike packBits this is one flat block of fixed
+        layout, so it can be written to a file, a memory map or shared
+        memory as it is and read back in place with Grid.fromBytes.
+        """
+        columnBytes = (self.height + 7) / 8
+        if columnBytes == 0: return ''
+        hexFormat = '%%0%dx' % (2 * columnBytes)
+        chunks = []
+        for column in self.data:
+            # The column as a binary number with its first cell lowest
+            cells = str(bytearray(column)).translate(_CELL_CHARS)[::-1]
+            chunks.append(binascii.unhexlify(hexFormat % int(cells, 2))[::-1])
+        return ''.join(chunks)
+
+    def fromBytes(data, width, height, offset=0):
+        """
+        Returns the width x height Grid that packBytes wrote at offset in
+        data, which may be a string, a bytearray, a buffer or an mmap; only
+        one column at a time is copied out of it.
+        """
+        grid = Grid(width, 0)
+        grid.height = height
+        columnBytes = (height + 7) / 8
+        cells = _BYTE_CELLS.__getitem__
+        for x in range(width):
+            start = offset + x * columnBytes
+            column = list(itertools.chain.from_iterable(map(cells, bytearray(data[start:start + columnBytes]))))
+            del column[height:]
+            grid.data[x] = column
+        return grid
+    fromBytes = staticmethod(fromBytes)
+
+def _byteCells():
+    "The 8 cells of every byte value, lowest bit first."
+    return [tuple([bool(byte >> bit & 1) for bit in range(8)]) for byte in range(256)]
+_BYTE_CELLS = _byteCells()
+_CELL_CHARS = string.maketrans('\x00\x01', '01')
+_CHAR_CELLS = {'0': False, '1': True}
+
+class FoodIndex:
+    """
+    The positions of the food in a food Grid, for counting, listing and
+    searching the remaining food without scanning the grid.  The rules
+    keep a state's index up to date as food is eaten (see
+    GameStateData.getFoodIndex).
+
+    An index never changes: remove returns a new index that shares every
+    column but one with the old one, the way successors share the columns
+    of their food grid.  source is the data of the grid it describes.
+    """
+    def __init__(self, columns, count, source):
+        self.columns = columns # for every x, the ys that have food
+        self.count = count
+        self.source = source
+
+    def fromGrid(grid):
+        columns = [tuple([y for y, cell in enumerate(column) if cell]) for column in grid.data]
+        return FoodIndex(columns, sum([len(column) for column in columns]), grid.data)
+    fromGrid = staticmethod(fromGrid)
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, position):
+        x, y = position
+        return self.source[x][y]
+
+    def asList(self):
+        "The food positions, in the order of Grid.asList."
+        return [(x, y) for x, column in enumerate(self.columns) for y in column]
+
+    def remove(self, position, source):
+        """
+        The index of the grid with data source, which is this one's without
+        the food at position.
+        """
+        x, y = position
+        columns = self.columns[:]
+        columns[x] = tuple([other for other in columns[x] if other != y])
+        return FoodIndex(columns, self.count - 1, source)
+
+    def getNearest(self, position, walls):
+        """
+        Returns (maze distance, position) of the food closest to position,
+        found by a breadth first search over the open cells of walls, or
+        None when no food can be reached.
+        """
+        width, height = walls.width, walls.height
+        x, y = nearestPoint(position)
+        if self.source[x][y]: return 0, (x, y)
+        if self.count == 0: return None
+        food, wallData = self.source, walls.data
+        seen = bytearray(width * height)
+        seen[x * height + y] = 1
+        frontier = [(x, y)]
+        distance = 0
+        while len(frontier) > 0:
+            distance += 1
+            reached = []
+            for x, y in frontier:
+                for nextX, nextY in ((x + 1, y), (x - 1, y), (x, y + 1), (x, y - 1)):
+                    if not (0 <= nextX < width and 0 <= nextY < height): continue
+                    cell = nextX * height + nextY
+                    if seen[cell] or wallData[nextX][nextY]: continue
+                    if food[nextX][nextY]: return distance, (nextX, nextY)
+                    seen[cell] = 1
+                    reached.append((nextX, nextY))
+            frontier = reached
+        return None
 
 def reconstituteGrid(bitRep):
     if type(bitRep) is not type((1,2)):
@@ -287,6 +416,14 @@ def reconstituteGrid(bitRep):
 class Actions:
     """
     A collection of static methods for manipulating move actions.
+
+    Agents see actions as Directions strings.  Internally every action also
+    has an integer code (CODES, and DIRECTIONS back), and a set of legal
+    actions is a 5-bit mask with bit 1 << code set for each action in it.
+    The legal action mask of every cell of a layout is computed once and
+    kept with the layout (see computeLegalMasks); the list methods below are a
+    thin layer over the masks that returns actions in the same order as
+    always.
     """
     # Directions
     _directions = {Directions.NORTH: (0, 1),
@@ -297,20 +434,72 @@ class Actions:
 
     _directionsAsList = _directions.items()
 
+    # Integer codes; game records store actions as these too
+    DIRECTIONS = [Directions.NORTH, Directions.SOUTH, Directions.EAST, Directions.WEST, Directions.STOP]
+    CODES = dict([(direction, code) for code, direction in enumerate(DIRECTIONS)])
+    REVERSE_CODES = [1, 0, 3, 2, 4]
+    STOP_BIT = 1 << CODES[Directions.STOP]
+    _reverse = dict([(direction, DIRECTIONS[REVERSE_CODES[code]]) for code, direction in enumerate(DIRECTIONS)])
+
     TOLERANCE = .001
 
     def reverseDirection(action):
-        if action == Directions.NORTH:
-            return Directions.SOUTH
-        if action == Directions.SOUTH:
-            return Directions.NORTH
-        if action == Directions.EAST:
-            return Directions.WEST
-        if action == Directions.WEST:
-            return Directions.EAST
-        return action
+        return Actions._reverse.get(action, action)
     reverseDirection = staticmethod(reverseDirection)
 
+    def toCode(action):
+        "The integer code of a Directions string (None for anything else)."
+        return Actions.CODES.get(action)
+    toCode = staticmethod(toCode)
+
+    def fromCode(code):
+        return Actions.DIRECTIONS[code]
+    fromCode = staticmethod(fromCode)
+
+    def maskToActions(mask):
+        "A new list of the actions in mask, in the order getPossibleActions uses."
+        return list(Actions._maskActions[mask])
+    maskToActions = staticmethod(maskToActions)
+
+    def inMask(action, mask):
+        "Whether the action (a Directions string) is in mask."
+        code = Actions.CODES.get(action)
+        return code != None and (mask >> code) & 1 == 1
+    inMask = staticmethod(inMask)
+
+    def getLegalMask(config, walls, masks=None):
+        """
+        The mask of the actions possible from config; the same actions as
+        getPossibleActions.  masks, the computeLegalMasks table of walls
+        (see Layout.getLegalMasks), saves looking at the walls.
+        """
+        x, y = config.pos
+        x_int, y_int = int(x + 0.5), int(y + 0.5)
+
+        # In between grid points, all agents must continue straight
+        if (abs(x - x_int) + abs(y - y_int)  > Actions.TOLERANCE):
+            return 1 << Actions.CODES[config.getDirection()]
+
+        if masks != None: return masks[x_int][y_int]
+        return Actions._cellMask(walls, x_int, y_int)
+    getLegalMask = staticmethod(getLegalMask)
+
+    def _cellMask(walls, x, y):
+        "The legal action mask of cell (x, y); moves off the grid count as blocked."
+        mask = 0
+        for dir, vec in Actions._directionsAsList:
+            dx, dy = vec
+            next_x, next_y = x + dx, y + dy
+            if next_x < 0 or next_x >= walls.width or next_y < 0 or next_y >= walls.height: continue
+            if not walls[next_x][next_y]: mask |= 1 << Actions.CODES[dir]
+        return mask
+    _cellMask = staticmethod(_cellMask)
+
+    def computeLegalMasks(walls):
+        "The legal action mask of every cell of walls, as masks[x][y]."
+        return [[Actions._cellMask(walls, x, y) for y in range(walls.height)] for x in range(walls.width)]
+    computeLegalMasks = staticmethod(computeLegalMasks)
+
     def vectorToDirection(vector):
         dx, dy = vector
         if dy > 0:
@@ -330,21 +519,7 @@ class Actions:
     directionToVector = staticmethod(directionToVector)
 
     def getPossibleActions(config, walls):
-        possible = []
-        x, y = config.pos
-        x_int, y_int = int(x + 0.5), int(y + 0.5)
-
-        # In between grid points, all agents must continue straight
-        if (abs(x - x_int) + abs(y - y_int)  > Actions.TOLERANCE):
-            return [config.getDirection()]
-
-        for dir, vec in Actions._directionsAsList:
-            dx, dy = vec
-            next_y = y_int + dy
-            next_x = x_int + dx
-            if not walls[next_x][next_y]: possible.append(dir)
-
-        return possible
+        return list(Actions._maskActions[Actions.getLegalMask(config, walls)])
 
     getPossibleActions = staticmethod(getPossibleActions)
 
@@ -368,6 +543,15 @@ class Actions:
         return (x + dx, y + dy)
     getSuccessor = staticmethod(getSuccessor)
 
+def _maskActions():
+    "The actions of every mask, in the order of Actions._directionsAsList."
+    table = []
+    for mask in range(1 << len(Actions.DIRECTIONS)):
+        table.append(tuple([direction for direction, vec in Actions._directionsAsList
+                            if mask & (1 << Actions.CODES[direction])]))
+    return table
+Actions._maskActions = _maskActions()
+
 class GameStateData:
     """
 
@@ -379,10 +563,22 @@ class GameStateData:
         if prevState != None:
             self.food = prevState.food.shallowCopy()
             self.capsules = prevState.capsules[:]
-            self.agentStates = self.copyAgentStates( prevState.agentStates )
+            # Agent states and ghost cells are shared until one side changes
+            # them (see ownAgentState and updateGhostCell)
+            self.agentStates = prevState.agentStates[:]
+            self._ownedAgents = prevState._ownedAgents = 0
+            self._ghostCells = prevState._ghostCells
+            self._foodIndex = prevState._foodIndex
+            self._ownsGhostCells = prevState._ownsGhostCells = False
             self.layout = prevState.layout
             self._eaten = prevState._eaten
             self.score = prevState.score
+            self.context = prevState.context
+        else:
+            self._ownedAgents = -1 # a bit per agent state this object may modify
+            self._ghostCells = None
+            self._foodIndex = None
+            self._ownsGhostCells = False
 
         self._foodEaten = None
         self._foodAdded = None
@@ -393,8 +589,14 @@ class GameStateData:
         self.scoreChange = 0
 
     def deepCopy( self ):
+        stats = self.context.stats
+        if stats != None: stats.deepCopies += 1
         state = GameStateData( self )
+        state.agentStates = self.copyAgentStates( self.agentStates )
+        state._ownedAgents = -1
         state.food = self.food.deepCopy()
+        if self._foodIndex != None and self._foodIndex.source is self.food.data:
+            state._foodIndex = FoodIndex(self._foodIndex.columns, self._foodIndex.count, state.food.data)
         state.layout = self.layout.deepCopy()
         state._agentMoved = self._agentMoved
         state._foodEaten = self._foodEaten
@@ -408,6 +610,62 @@ class GameStateData:
             copiedStates.append( agentState.copy() )
         return copiedStates
 
+    def ownAgentState( self, index ):
+        """
+        Returns agentStates[index] for the rules to modify.  A successor
+        shares its predecessor's AgentStates, so the shared one is copied
+        first; copying a state is then O(1) in the number of agents.
+        """
+        bit = 1 << index
+        if not self._ownedAgents & bit:
+            self.agentStates[index] = self.agentStates[index].copy()
+            self._ownedAgents |= bit
+        return self.agentStates[index]
+
+    def getFoodIndex( self ):
+        """
+        The FoodIndex of the food grid.  Successors share it until food is
+        eaten, when PacmanRules.consume replaces it; it is only rebuilt
+        from the grid when the grid was replaced by other means.
+        """
+        if self._foodIndex == None or self._foodIndex.source is not self.food.data:
+            self._foodIndex = FoodIndex.fromGrid( self.food )
+        return self._foodIndex
+
+    def getGhostCells( self ):
+        """
+        An occupancy index of the ghosts: a dictionary from grid cell (the
+        nearest point of a ghost's position) to the indices of the ghosts in
+        it.  It is built on first use, passed on to successors and kept up
+        to date by updateGhostCell as ghosts move.
+        """
+        if self._ghostCells == None:
+            cells = {}
+            for index in range( 1, len( self.agentStates ) ):
+                cell = nearestPoint( self.agentStates[index].configuration.pos )
+                cells[cell] = cells.get( cell, () ) + (index,)
+            self._ghostCells = cells
+            self._ownsGhostCells = True
+        return self._ghostCells
+
+    def updateGhostCell( self, index, oldPosition ):
+        """
+        Moves ghost index from the cell of oldPosition to the cell of its
+        current position in the ghost cells, if they have been built.
+        """
+        cells = self._ghostCells
+        if cells == None: return
+        old = nearestPoint( oldPosition )
+        new = nearestPoint( self.agentStates[index].configuration.pos )
+        if old == new: return
+        if not self._ownsGhostCells:
+            cells = self._ghostCells = dict( cells )
+            self._ownsGhostCells = True
+        remaining = tuple( [i for i in cells[old] if i != index] )
+        if len(remaining) > 0: cells[old] = remaining
+        else: del cells[old]
+        cells[new] = cells.get( new, () ) + (index,)
+
     def __eq__( self, other ):
         """
         Allows two states to be compared.
@@ -494,6 +752,7 @@ class GameStateData:
         self.layout = layout
         self.score = 0
         self.scoreChange = 0
+        self.context = GameContext()
 
         self.agentStates = []
         numGhosts = 0
@@ -503,6 +762,221 @@ class GameStateData:
                 else: numGhosts += 1
             self.agentStates.append( AgentState( Configuration( pos, Directions.STOP), isPacman) )
         self._eaten = [False for a in self.agentStates]
+        self._ownedAgents = -1
+        self._ghostCells = None
+        self._foodIndex = FoodIndex.fromGrid( self.food )
+
+class GameContext:
+    """
+    Everything that belongs to one running game rather than to the process:
+    the forward model budget, the game clock, the move history and the
+    random number source.  All GameStates of a game, including the ones
+    agents generate, share one context through GameStateData.context, so
+    several games can run side by side in one process.
+    """
+    def __init__( self, budget=None, rng=None, timeLimit=30 ):
+        self.budget = budget         # BudgetScheduler, None for unlimited
+        self.rng = rng               # util.RandomStream, None for the random module
+        self.timeLimit = timeLimit   # seconds before the game is stopped
+        self.startTime = None
+        self.totalFoodAndCapsules = 0
+        self.movementHistory = []    # Pacman's moves, filled in at game end
+        self.notLossButTime = False
+        self.fileName = ""           # if set, Pacman's moves are written there
+        self.stats = None            # GameStats of the running game
+
+    def getRandom( self ):
+        "The random number source: rng, or the random module when it is None."
+        if self.rng == None: return random
+        return self.rng
+
+    def withRandom( self, rng ):
+        "Returns a copy of this context that draws from rng."
+        context = copy.copy( self )
+        context.rng = rng
+        return context
+
+class BudgetScheduler:
+    """
+    Owns the forward model budget of one game and hands it out one Pacman
+    move at a time.  Agents reach it through GameState.getBudget; every
+    generatePacmanSuccessor call consumes one unit of it.
+
+    By default every move gets maxIterations successor calls, plus whatever
+    the previous move left unused (at most another maxIterations) when
+    carryOver is set.  With totalIterations
+    (successor calls) and/or totalTime (seconds) the budget is shared by the
+    whole game instead: a move gets the remaining budget divided by the
+    number of moves expected to remain, weighted by how much the decision
+    seems to matter (fewer legal actions and distant ghosts mean less
+    effort).  Anything a move leaves unused goes back into the pool.
+
+    However little the shared budget holds, a move always gets at least
+    MIN_CALLS_PER_ACTION successor calls per legal action, and the time
+    deadline only applies once they are used, so every action can be tried
+    at least once.  A fixed maxIterations per move is used as given.
+    """
+    MOVES_PER_FOOD = 2   # rough number of moves expected per remaining food
+    MIN_MOVES = 10       # never plan for fewer remaining moves than this
+    MIN_CALLS_PER_ACTION = 1
+
+    def __init__( self, maxIterations, totalIterations=None, totalTime=None, carryOver=False ):
+        self.maxIterations = maxIterations
+        self.totalIterations = totalIterations
+        self.totalTime = totalTime
+        self.carryOver = carryOver
+        self.usedIterations = 0
+        self.usedTime = 0.0
+        self.moves = 0
+        self.allocation = maxIterations
+        # remaining counts like the old per-move iteration counter: it is
+        # decremented before the check, so the last unit is never served
+        self.remaining = maxIterations
+        self.deadline = None
+        self.moveStart = None
+        self.minimum = 0
+
+    def startMove( self, state ):
+        """
+        Computes the allocation for the move about to be made from state.
+        """
+        carried = 0
+        if self.carryOver and self.moves > 0:
+            carried = min( max(0, self.remaining - 1), self.maxIterations )
+        self.moveStart = time.time()
+        self.deadline = None
+        self.minimum = 0
+        if self.totalIterations == None and self.totalTime == None:
+            self.allocation = self.maxIterations + carried
+        else:
+            self.minimum = BudgetScheduler.MIN_CALLS_PER_ACTION * len( state.getLegalPacmanActions() )
+            weight = self.getMoveWeight( state )
+            movesLeft = max( BudgetScheduler.MIN_MOVES, BudgetScheduler.MOVES_PER_FOOD * state.getNumFood() )
+            self.allocation = self.maxIterations + carried
+            if self.totalIterations != None:
+                left = self.totalIterations - self.usedIterations
+                share = int( weight * left / float(movesLeft) )
+                self.allocation = max( 1, min( left, share ) + 1 )
+            if self.totalTime != None:
+                left = self.totalTime - self.usedTime
+                self.deadline = self.moveStart + max( 0.0, weight * left / movesLeft )
+            self.allocation = max( self.allocation, self.minimum + 1 )
+        self.remaining = self.allocation
+        return self.allocation
+
+    def getMoveWeight( self, state ):
+        """
+        Relative importance of deciding in state, around 1 for an ordinary move.
+        """
+        numLegal = len( state.getLegalPacmanActions() )
+        if numLegal <= 1: weight = 0.1
+        elif numLegal == 2: weight = 0.5
+        else: weight = 1.0
+        pacmanPosition = state.getPacmanPosition()
+        distances = [manhattanDistance( pacmanPosition, ghost.getPosition() )
+                     for ghost in state.getGhostStates() if ghost.scaredTimer == 0]
+        if len(distances) > 0:
+            weight *= 1.0 + 2.0 / (1.0 + min(distances))
+        return weight
+
+    def endMove( self ):
+        self.moves += 1
+        self.usedIterations += self.allocation - max( 1, self.remaining )
+        if self.moveStart != None:
+            self.usedTime += time.time() - self.moveStart
+        self.moveStart = None
+        self.deadline = None
+
+    def consume( self ):
+        """
+        Uses up one successor call; returns False once the move's budget is spent.
+        """
+        self.remaining -= 1
+        if self.remaining <= 0:
+            return False
+        if self.deadline != None and self.allocation - self.remaining > self.minimum \
+           and time.time() > self.deadline:
+            self.remaining = 0
+            return False
+        return True
+
+    def getRemaining( self ):
+        "Returns how many more successor calls the current move may make."
+        return max( 0, self.remaining - 1 )
+
+    def getAllocation( self ):
+        "Returns the number of successor calls granted to the current move."
+        return max( 0, self.allocation - 1 )
+
+class GameStats:
+    """
+    Per-agent measurements that Game.run records for every move: a histogram
+    of the time spent in getAction, the successor calls the move took from
+    the budget, the deep copies of the state made while deciding, and the
+    time the engine then spent applying the action (rules) and drawing it
+    (display).  The counters are plain numbers and lists so that the stats
+    of a finished game can be pickled, printed with summary() or written as
+    JSON from asDict().
+    """
+    HISTOGRAM_BOUNDS = [0.001, 0.01, 0.1, 1.0, 10.0] # upper bucket edges in seconds
+
+    def __init__( self, agentNames ):
+        numAgents = len(agentNames)
+        self.agentNames = agentNames
+        self.moves = [0] * numAgents
+        self.moveTime = [0.0] * numAgents
+        self.maxMoveTime = [0.0] * numAgents
+        self.histograms = [[0] * (len(GameStats.HISTOGRAM_BOUNDS) + 1) for i in range(numAgents)]
+        self.successorCalls = [0] * numAgents
+        self.copies = [0] * numAgents
+        self.rulesTime = [0.0] * numAgents
+        self.displayTime = [0.0] * numAgents
+        # Counted by GameStateData.deepCopy and attributed to the agent
+        # that is moving by Game.run
+        self.deepCopies = 0
+
+    def recordMove( self, agentIndex, seconds, successorCalls, copies ):
+        self.moves[agentIndex] += 1
+        self.moveTime[agentIndex] += seconds
+        self.maxMoveTime[agentIndex] = max( self.maxMoveTime[agentIndex], seconds )
+        self.histograms[agentIndex][bisect.bisect( GameStats.HISTOGRAM_BOUNDS, seconds )] += 1
+        self.successorCalls[agentIndex] += successorCalls
+        self.copies[agentIndex] += copies
+
+    def recordRules( self, agentIndex, seconds ):
+        self.rulesTime[agentIndex] += seconds
+
+    def recordDisplay( self, agentIndex, seconds ):
+        self.displayTime[agentIndex] += seconds
+
+    def asDict( self ):
+        """
+        One dictionary per agent, suitable for json.dump.
+        """
+        agents = []
+        for i, name in enumerate( self.agentNames ):
+            agents.append( { 'agent': i, 'name': name, 'moves': self.moves[i],
+                             'moveTime': self.moveTime[i], 'maxMoveTime': self.maxMoveTime[i],
+                             'histogram': self.histograms[i], 'successorCalls': self.successorCalls[i],
+                             'deepCopies': self.copies[i], 'rulesTime': self.rulesTime[i],
+                             'displayTime': self.displayTime[i] } )
+        return { 'histogramBounds': GameStats.HISTOGRAM_BOUNDS, 'agents': agents }
+
+    def summary( self ):
+        """
+        A table with one line per agent; times are in milliseconds.
+        """
+        buckets = [['<%gms' % (1000 * bound), '<%gs' % bound][bound >= 1] for bound in GameStats.HISTOGRAM_BOUNDS]
+        buckets.append( '>=%gs' % GameStats.HISTOGRAM_BOUNDS[-1] )
+        lines = ['%-22s %6s %9s %9s %s %9s %7s %9s %9s' % (('Agent', 'Moves', 'Mean', 'Max') +
+                 (' '.join(['%7s' % b for b in buckets]),) + ('Calls', 'Copies', 'Rules', 'Display'))]
+        for i, name in enumerate( self.agentNames ):
+            mean = 0.0
+            if self.moves[i] > 0: mean = self.moveTime[i] / self.moves[i]
+            lines.append( '%-22s %6d %9.2f %9.2f %s %9d %7d %9.1f %9.1f' % ('%d %s' % (i, name), self.moves[i],
+                          1000 * mean, 1000 * self.maxMoveTime[i], ' '.join(['%7d' % n for n in self.histograms[i]]),
+                          self.successorCalls[i], self.copies[i], 1000 * self.rulesTime[i], 1000 * self.displayTime[i]) )
+        return '\n'.join( lines )
 
 try:
     import boinc
@@ -514,13 +988,6 @@ class Game:
     """
     The Game manages the control flow, soliciting actions from agents.
     """
-    currentIterations=1000
-    maxIterations=1000
-    timeLimit=30
-    totalFoodAndCapsules=0
-    movementHistory=[]
-    notLossButTime = False
-    fileName=""
 
     def __init__( self, agents, display, rules, startingIndex=0, muteAgents=False, catchExceptions=False ):
         self.agentCrashed = False
@@ -532,9 +999,12 @@ class Game:
         self.muteAgents = muteAgents
         self.catchExceptions = catchExceptions
         self.moveHistory = []
+        self.recorder = None # e.g. a gameRecord.GameRecorder, told every move
+        self.jointGhostStep = False # see stepGhosts
         self.totalAgentTimes = [0 for agent in agents]
         self.totalAgentTimeWarnings = [0 for agent in agents]
         self.agentTimeout = False
+        self.stats = GameStats( [agent.__class__.__name__ for agent in agents] )
         import cStringIO
         self.agentOutput = [cStringIO.StringIO() for agent in agents]
 
@@ -551,25 +1021,63 @@ class Game:
         self.agentCrashed = True
         self.rules.agentCrash(self, agentIndex)
 
-    OLD_STDOUT = None
-    OLD_STDERR = None
+    def observe(self, agentIndex, agent):
+        "The state as handed to agent (see Agent.copyObservations)."
+        if getattr(agent, 'copyObservations', False):
+            return self.state.deepCopy()
+        return self.state.makeObservation(agentIndex)
 
     def mute(self, agentIndex):
         if not self.muteAgents: return
-        global OLD_STDOUT, OLD_STDERR
-        import cStringIO
-        OLD_STDOUT = sys.stdout
-        OLD_STDERR = sys.stderr
+        self.oldStdout = sys.stdout
+        self.oldStderr = sys.stderr
         sys.stdout = self.agentOutput[agentIndex]
         sys.stderr = self.agentOutput[agentIndex]
 
     def unmute(self):
         if not self.muteAgents: return
-        global OLD_STDOUT, OLD_STDERR
         # Revert stdout/stderr to originals
-        sys.stdout = OLD_STDOUT
-        sys.stderr = OLD_STDERR
+        sys.stdout = self.oldStdout
+        sys.stderr = self.oldStderr
+
 
+    def stepGhosts( self, firstIndex ):
+        """
+        Moves ghosts firstIndex, firstIndex + 1, ... in one joint step.  The
+        ghosts share a single observation, which is advanced in place after
+        each of them (see GameState.advanceGhost), so every ghost sees the
+        same state as in the one-agent-per-turn loop and the game is
+        identical.  Rules and display run once, after the last ghost (or
+        after the ghost that ended the game).  Ghosts that keep or change the
+        state they are given must set copyObservations, as in the one-agent
+        loop; they get a deep copy of it.
+        """
+        stats = self.stats
+        state = self.state.makeObservation( firstIndex )
+        for agentIndex in range( firstIndex, len(self.agents) ):
+            agent = self.agents[agentIndex]
+            observation = state
+            if getattr(agent, 'copyObservations', False): observation = state.deepCopy()
+            deepCopies = stats.deepCopies
+            moveStart = time.time()
+            self.mute(agentIndex)
+            action = agent.getAction( observation )
+            self.unmute()
+            moveEnd = time.time()
+            stats.recordMove( agentIndex, moveEnd - moveStart, 0, stats.deepCopies - deepCopies )
+            self.moveHistory.append( (agentIndex, action) )
+            if self.recorder != None: self.recorder.recordMove( agentIndex, action, state )
+            state.advanceGhost( agentIndex, action )
+            stats.recordRules( agentIndex, time.time() - moveEnd )
+            if state.isWin() or state.isLose(): break
+        self.state = state
+
+        displayStart = time.time()
+        self.display.update( self.state.data )
+        stats.recordDisplay( agentIndex, time.time() - displayStart )
+        rulesStart = time.time()
+        self.rules.process( self.state, self )
+        stats.recordRules( agentIndex, time.time() - rulesStart )
 
     def run( self ):
         """
@@ -577,7 +1085,10 @@ class Game:
         """
         self.display.initialize(self.state.data)
         self.numMoves = 0
-        Game.totalFoodAndCapsules = self.state.getNumFood() + len(self.state.getCapsules());
+        self.context = self.state.data.context
+        budget = self.context.budget
+        stats = self.context.stats = self.stats
+        self.context.totalFoodAndCapsules = self.state.getNumFood() + len(self.state.getCapsules());
 
         ###self.display.initialize(self.state.makeObservation(1).data)
         # inform learning agents of the game start
@@ -595,10 +1106,10 @@ class Game:
                 self.mute(i)
                 if self.catchExceptions:
                     try:
-                        timed_func = TimeoutFunction(agent.registerInitialState, int(self.rules.getMaxStartupTime(i)))
+                        timed_func = TimeoutFunction(agent.registerInitialState, self.rules.getMaxStartupTime(i))
                         try:
                             start_time = time.time()
-                            timed_func(self.state.deepCopy())
+                            timed_func(self.observe(i, agent))
                             time_taken = time.time() - start_time
                             self.totalAgentTimes[i] += time_taken
                         except TimeoutFunctionException:
@@ -612,21 +1123,31 @@ class Game:
                         self.unmute()
                         return
                 else:
-                    agent.registerInitialState(self.state.deepCopy())
+                    agent.registerInitialState(self.observe(i, agent))
                 ## TODO: could this exceed the total time
                 self.unmute()
 
         agentIndex = self.startingIndex
         numAgents = len( self.agents )
-        gameStart = time.time()
+        gameStart = self.context.startTime = time.time()
+
+        while (not self.gameOver) and (time.time()-gameStart < self.context.timeLimit):
+            if self.jointGhostStep and agentIndex != 0:
+                self.stepGhosts( agentIndex )
+                agentIndex = 0
+                continue
 
-        while (not self.gameOver) and (time.time()-gameStart < Game.timeLimit):
             # Fetch the next agent
             agent = self.agents[agentIndex]
             move_time = 0
             skip_action = False
             # Generate an observation of the state
-            observation = self.state.deepCopy()
+            observation = self.observe(agentIndex, agent)
+            if agentIndex == 0 and budget != None: budget.startMove( observation )
+            usedIterations = 0
+            if budget != None: usedIterations = budget.usedIterations
+            deepCopies = stats.deepCopies
+            moveStart = time.time()
 
             # Solicit an action
             action = None
@@ -634,7 +1155,8 @@ class Game:
 
             if self.catchExceptions:
                 try:
-                    timed_func = TimeoutFunction(agent.getAction, int(self.rules.getMoveTimeout(agentIndex)) - int(move_time))
+                    timed_func = TimeoutFunction(agent.getAction, self.rules.getMoveTimeout(agentIndex) - move_time,
+                                                 self.rules.getMoveWarningTime(agentIndex))
                     try:
                         start_time = time.time()
                         if skip_action:
@@ -675,9 +1197,14 @@ class Game:
             else:
                 action = agent.getAction(observation)
             self.unmute()
+            moveEnd = time.time()
+            if agentIndex == 0 and budget != None: budget.endMove()
+            if budget != None: usedIterations = budget.usedIterations - usedIterations
+            stats.recordMove( agentIndex, moveEnd - moveStart, usedIterations, stats.deepCopies - deepCopies )
 
             # Execute the action
             self.moveHistory.append( (agentIndex, action) )
+            if self.recorder != None: self.recorder.recordMove( agentIndex, action, self.state )
             if self.catchExceptions:
                 try:
                     self.state = self.state.generateSuccessor( agentIndex, action )
@@ -688,28 +1215,32 @@ class Game:
                     return
             else:
                 self.state = self.state.generateSuccessor( agentIndex, action )
+            rulesTime = time.time() - moveEnd
 
             # Change the display
+            displayStart = time.time()
             self.display.update( self.state.data )
             ###idx = agentIndex - agentIndex % 2 + 1
             ###self.display.update( self.state.makeObservation(idx).data )
+            stats.recordDisplay( agentIndex, time.time() - displayStart )
 
             # Allow for game specific conditions (winning, losing, etc.)
+            rulesStart = time.time()
             self.rules.process(self.state, self)
+            stats.recordRules( agentIndex, rulesTime + time.time() - rulesStart )
             # Track progress
             if agentIndex == numAgents + 1: self.numMoves += 1
-            if agentIndex == 0: Game.currentIterations = Game.maxIterations
             # Next agent
             agentIndex = ( agentIndex + 1 ) % numAgents
 
             if _BOINC_ENABLED:
                 boinc.set_fraction_done(self.getProgress())
 
-        Game.notLossButTime = time.time()-gameStart < Game.timeLimit
-        Game.movementHistory = [y[1] for x,y in enumerate(self.moveHistory) if y[0] == 0]
-        if len(Game.fileName) > 0:
-            f = open(Game.fileName, "w")
-            for a in Game.movementHistory:
+        self.context.notLossButTime = time.time()-gameStart < self.context.timeLimit
+        self.context.movementHistory = [y[1] for x,y in enumerate(self.moveHistory) if y[0] == 0]
+        if len(self.context.fileName) > 0:
+            f = open(self.context.fileName, "w")
+            for a in self.context.movementHistory:
                 f.write(a + "\n")
             f.close()
         # inform a learning agent of the game result
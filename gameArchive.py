@@ -0,0 +1,115 @@
+# gameArchive.py
+# --------------
+# Licensing Information:  You are free to use or extend these projects for
+# educational purposes provided that (1) you do not distribute or publish
+# solutions, (2) you retain this notice, and (3) you provide clear
+# attribution to UC Berkeley, including a link to http://ai.berkeley.edu.
+#
+# Attribution Information: The Pacman AI projects were developed at UC Berkeley.
+# The core projects and autograders were primarily created by John DeNero
+# (denero@cs.berkeley.edu) and Dan Klein (klein@cs.berkeley.edu).
+# Student side autograding was added by Brad Miller, Nick Hay, and
+# Pieter Abbeel (pabbeel@cs.berkeley.edu).
+
+
+"""
+GameArchive.py keeps many game records (see gameRecord.py) in a single
+append-only file instead of one file per game:
+
+  python pacman.py -q -n 1000 --workers 8 --archive nightly.pma
+  python pacman.py --replay nightly.pma --replayGame 17
+
+The archive is the records one after the other.  Next to it, the index
+file <archive>.index holds one JSON line per game with its offset and
+length in the archive, the run that played it and its number in that run,
+the layout, the agents, the seeds, the score, the outcome and the number
+of plies, so games can be listed and selected without reading the
+archive.  Parallel runs add games in the order they finish, so games are
+selected by their number (see findGame), never by their position.
+
+Appends take an exclusive flock on the archive, so any number of processes
+(or threads) can add games to the same archive.  A single game is read
+through a memory map of the archive, at the offset its index entry gives.
+"""
+
+import os, json, mmap, fcntl
+import gameRecord
+
+class GameArchive:
+    """
+    An archive of game records and its index.
+    """
+    def __init__( self, fileName ):
+        self.fileName = fileName
+        self.indexFileName = fileName + '.index'
+
+    def append( self, record, entry ):
+        """
+        Adds a record (the bytes a GameRecorder wrote) with the index entry
+        (a dictionary); 'offset' and 'length' are filled in.  Returns the
+        entry.
+        """
+        f = open( self.fileName, 'ab' )
+        try:
+            fcntl.flock( f.fileno(), fcntl.LOCK_EX )
+            try:
+                f.seek( 0, os.SEEK_END )
+                entry = dict( entry )
+                entry['offset'] = f.tell()
+                entry['length'] = len(record)
+                f.write( record )
+                f.flush()
+                index = open( self.indexFileName, 'a' )
+                try: index.write( json.dumps( entry, sort_keys=True ) + '\n' )
+                finally: index.close()
+            finally:
+                fcntl.flock( f.fileno(), fcntl.LOCK_UN )
+        finally:
+            f.close()
+        return entry
+
+    def getIndex( self ):
+        """
+        The index entries of all games, in the order they were added.
+        """
+        if not os.path.exists( self.indexFileName ): return []
+        f = open( self.indexFileName )
+        try: return [json.loads( line ) for line in f if line.strip() != '']
+        finally: f.close()
+
+    def query( self, **criteria ):
+        """
+        The index entries whose fields equal the given values, e.g.
+        query(layout='smallClassic', win=True).
+        """
+        return [entry for entry in self.getIndex()
+                if all( [entry.get( key ) == value for key, value in criteria.items()] )]
+
+    def findGame( self, game, run=None ):
+        """
+        The index entry of game number game of run, or of the last run in
+        the archive that has such a game when run is None; None if there is
+        none.  Archives written before entries carried their number are
+        indexed by position.
+        """
+        index = self.getIndex()
+        matches = [entry for entry in index
+                   if entry.get( 'game' ) == game and (run == None or entry.get( 'run' ) == run)]
+        if len(matches) > 0: return matches[-1]
+        if run == None and 0 <= game < len(index) and all( ['game' not in entry for entry in index] ):
+            return index[game]
+        return None
+
+    def openGame( self, entry ):
+        """
+        A gameRecord.GameRecordReader for the game of the index entry,
+        reading from a memory map of the archive.
+        """
+        f = open( self.fileName, 'rb' )
+        try: data = mmap.mmap( f.fileno(), 0, access=mmap.ACCESS_READ )
+        finally: f.close()
+        return gameRecord.GameRecordReader( data, entry['offset'], entry['length'] )
+
+def isArchive( fileName ):
+    "Whether fileName is an archive, i.e. has an index file."
+    return os.path.exists( GameArchive( fileName ).indexFileName )
@@ -0,0 +1,285 @@
+# gameRecord.py
+# -------------
+# Licensing Information:  You are free to use or extend these projects for
+# educational purposes provided that (1) you do not distribute or publish
+# solutions, (2) you retain this notice, and (3) you provide clear
+# attribution to UC Berkeley, including a link to http://ai.berkeley.edu.
+#
+# Attribution Information: The Pacman AI projects were developed at UC Berkeley.
+# The core projects and autograders were primarily created by John DeNero
+# (denero@cs.berkeley.edu) and Dan Klein (klein@cs.berkeley.edu).
+# Student side autograding was added by Brad Miller, Nick Hay, and
+# Pieter Abbeel (pabbeel@cs.berkeley.edu).
+
+
+"""
+GameRecord.py reads and writes the binary game records made by
+pacman.py -r and played back by pacman.py --replay.  A record is
+
+  MAGIC (4 bytes) | VERSION (1 byte) | header length (4 bytes, big endian)
+  | header (JSON) | one byte per move, with a keyframe every K plies ...
+
+The header holds the layout's name and hash (see Layout.getHash) instead of
+the layout itself, the number of agents, the agent that moves first, the
+keyframe interval K and the seeds of the game.  Moves follow in the order
+they were made; the moving agent is implied by the turn order, so a move is
+just its action code (see ACTIONS).  Moves are appended and flushed as the
+game runs, so the record of a game that was interrupted can still be
+replayed, and a replay reads the moves as a stream with constant memory.
+
+Before every K-th move the state reached so far is written as a keyframe:
+the KEYFRAME byte, the length of the state (4 bytes) and the state itself
+(see serializeState).  GameRecordReader.seek uses them to jump to any ply
+by replaying at most K - 1 moves.
+"""
+
+from game import Actions
+from game import GameStateData
+from game import GameContext
+from game import AgentState
+from game import Configuration
+from game import reconstituteGrid
+import struct, json, zlib, cPickle
+
+MAGIC = 'PMGR'
+VERSION = 2
+READABLE_VERSIONS = [1, 2] # version 1 had no keyframes
+_PREAMBLE = struct.Struct( '>4sBI' )
+_LENGTH = struct.Struct( '>I' )
+READ_SIZE = 4096
+KEYFRAME = '\xfe'
+KEYFRAME_INTERVAL = 200
+
+ACTIONS = Actions.DIRECTIONS
+ACTION_CODES = Actions.CODES
+
+def serializeState( data ):
+    """
+    A compact string holding what a GameStateData needs to continue the
+    game from it (the layout is known from the record's header).
+    """
+    agents = []
+    for agentState in data.agentStates:
+        start, configuration = agentState.start, agentState.configuration
+        agents.append( (start.pos, ACTION_CODES[start.direction], configuration.pos,
+                        ACTION_CODES[configuration.direction], agentState.isPacman, agentState.scaredTimer) )
+    fields = (data.score, data.food.packBits(), data.capsules, agents, data._eaten, data._win, data._lose)
+    return zlib.compress( cPickle.dumps( fields, 2 ) )
+
+def deserializeState( string, layout ):
+    """
+    The GameStateData on layout that serializeState turned into string.
+    """
+    score, food, capsules, agents, eaten, win, lose = cPickle.loads( zlib.decompress( string ) )
+    data = GameStateData()
+    data.layout = layout
+    data.score = score
+    data.food = reconstituteGrid( food )
+    data.capsules = capsules
+    data.agentStates = []
+    for startPos, startDirection, pos, direction, isPacman, scaredTimer in agents:
+        agentState = AgentState( Configuration( startPos, ACTIONS[startDirection] ), isPacman )
+        agentState.configuration = Configuration( pos, ACTIONS[direction] )
+        agentState.scaredTimer = scaredTimer
+        data.agentStates.append( agentState )
+    data._eaten = eaten
+    data._win, data._lose = win, lose
+    data.context = GameContext()
+    return data
+
+def isGameRecord( fileName ):
+    "Whether fileName starts like a binary game record."
+    f = open( fileName, 'rb' )
+    try: return f.read( len(MAGIC) ) == MAGIC
+    finally: f.close()
+
+class GameRecorder:
+    """
+    Writes the record of one game to output, a file name or an open file;
+    Game.run calls recordMove for every move.
+    """
+    def __init__( self, output, layout, numAgents, startingIndex=0, seed=None, rngSeed=None, keyframeInterval=KEYFRAME_INTERVAL ):
+        self.keyframeInterval = keyframeInterval
+        self.ply = 0
+        self.header = { 'layout': layout.name, 'layoutHash': layout.getHash(),
+                        'numAgents': numAgents, 'startingIndex': startingIndex,
+                        'seed': seed, 'rngSeed': rngSeed, 'keyframeInterval': keyframeInterval }
+        if isinstance( output, basestring ): output = open( output, 'wb' )
+        self.file = output
+        header = json.dumps( self.header, sort_keys=True )
+        self.file.write( _PREAMBLE.pack( MAGIC, VERSION, len(header) ) )
+        self.file.write( header )
+        self.file.flush()
+
+    def recordMove( self, agentIndex, action, state ):
+        """
+        Records that agentIndex made action in state (a GameState).
+        """
+        if self.ply > 0 and self.keyframeInterval > 0 and self.ply % self.keyframeInterval == 0:
+            string = serializeState( state.data )
+            self.file.write( KEYFRAME + _LENGTH.pack( len(string) ) + string )
+        self.file.write( chr( ACTION_CODES[action] ) )
+        self.file.flush()
+        self.ply += 1
+
+    def close( self ):
+        self.file.close()
+
+class GameRecordReader:
+    """
+    Reads a record written by GameRecorder from source, a file name or an
+    open file (or mmap).  A record stored inside a larger file (see
+    gameArchive.py) starts at offset and is length bytes long.
+    """
+    def __init__( self, source, offset=0, length=None ):
+        if isinstance( source, basestring ): source = open( source, 'rb' )
+        self.file = source
+        self.end = None
+        if length != None: self.end = offset + length
+        self.file.seek( offset )
+        magic, version, headerLength = _PREAMBLE.unpack( self.file.read( _PREAMBLE.size ) )
+        if magic != MAGIC: raise Exception( 'No game record at offset %d' % offset )
+        if version not in READABLE_VERSIONS: raise Exception( 'Unknown game record version %d' % version )
+        self.header = json.loads( self.file.read( headerLength ) )
+        self.dataStart = self.file.tell()
+        self.keyframes = None
+        self.layout = None
+        self._goto( self.dataStart, 0 )
+
+    def _goto( self, position, ply ):
+        self.file.seek( position )
+        self.buffer = ''
+        self.index = 0
+        self.position = position
+        self.ply = ply
+
+    def _read( self, n ):
+        "The next n bytes of the record (fewer at its end)."
+        if self.index + n > len(self.buffer):
+            size = max( n, READ_SIZE )
+            if self.end != None: size = min( size, self.end - self.position - (len(self.buffer) - self.index) )
+            self.buffer = self.buffer[self.index:] + self.file.read( max( 0, size ) )
+            self.index = 0
+        data = self.buffer[self.index:self.index + n]
+        self.index += len(data)
+        self.position += len(data)
+        return data
+
+    def _skip( self, n ):
+        if self.index + n <= len(self.buffer):
+            self.index += n
+            self.position += n
+        else:
+            self._goto( self.position + n, self.ply )
+
+    def getLayout( self ):
+        """
+        Loads the recorded layout by name, falling back to a search of the
+        layouts directory by hash when the name is unknown or its file has
+        changed since the game was recorded.
+        """
+        import layout
+        result = None
+        if self.header['layout'] != None: result = layout.getLayout( self.header['layout'] )
+        if result == None or result.getHash() != self.header['layoutHash']:
+            result = layout.findLayout( self.header['layoutHash'] )
+        if result == None:
+            raise Exception( 'The layout of this record (%s, %s) cannot be found' % (self.header['layout'], self.header['layoutHash']) )
+        return result
+
+    def getInitialState( self ):
+        import pacman
+        if self.layout == None: self.layout = self.getLayout()
+        state = pacman.GameState()
+        state.initialize( self.layout, self.header['numAgents'] - 1 )
+        return state
+
+    def nextMove( self ):
+        """
+        Reads the next move: returns (agentIndex, action), or None at the end
+        of the record.  Keyframes are skipped.
+        """
+        byte = self._read( 1 )
+        while byte == KEYFRAME:
+            self._skip( _LENGTH.unpack( self._read( _LENGTH.size ) )[0] )
+            byte = self._read( 1 )
+        if byte == '': return None
+        agentIndex = (self.header['startingIndex'] + self.ply) % self.header['numAgents']
+        self.ply += 1
+        return agentIndex, ACTIONS[ord( byte )]
+
+    def moves( self ):
+        """
+        Generates the (agentIndex, action) pairs of the game in order from
+        the current ply on.
+        """
+        while True:
+            move = self.nextMove()
+            if move == None: return
+            yield move
+
+    def getKeyframes( self ):
+        """
+        The (ply, position) of every keyframe, position being the file
+        offset of its length.  The first call scans the record once.
+        """
+        if self.keyframes == None:
+            position, ply = self.position, self.ply
+            self._goto( self.dataStart, 0 )
+            self.keyframes = []
+            while True:
+                byte = self._read( 1 )
+                if byte == '': break
+                if byte == KEYFRAME:
+                    self.keyframes.append( (self.ply, self.position) )
+                    self._skip( _LENGTH.unpack( self._read( _LENGTH.size ) )[0] )
+                else:
+                    self.ply += 1
+            self._goto( position, ply )
+        return self.keyframes
+
+    def seek( self, ply ):
+        """
+        Returns the GameState after ply moves (or at the end of a shorter
+        game); moves() then continues from there.
+        """
+        start = None
+        for keyframePly, position in self.getKeyframes():
+            if keyframePly <= ply: start = (keyframePly, position)
+        if start == None:
+            state = self.getInitialState()
+            self._goto( self.dataStart, 0 )
+        else:
+            import pacman
+            if self.layout == None: self.layout = self.getLayout()
+            self._goto( start[1], start[0] )
+            length = _LENGTH.unpack( self._read( _LENGTH.size ) )[0]
+            state = pacman.GameState()
+            state.data = deserializeState( self._read( length ), self.layout )
+        while self.ply < ply:
+            move = self.nextMove()
+            if move == None: break
+            state = state.generateSuccessor( *move )
+        return state
+
+    def close( self ):
+        self.file.close()
+
+def replayRecord( source, display, startPly=0 ):
+    """
+    Plays the recorded game in source (a file name or a GameRecordReader)
+    back on display from startPly on.  Returns the final state and the
+    number of plies in the game.
+    """
+    reader = source
+    if not isinstance( reader, GameRecordReader ): reader = GameRecordReader( source )
+    try:
+        state = reader.seek( startPly )
+        display.initialize( state.data )
+        for agentIndex, action in reader.moves():
+            state = state.generateSuccessor( agentIndex, action )
+            display.update( state.data )
+        display.finish()
+        return state, reader.ply
+    finally:
+        reader.close()
@@ -15,27 +15,136 @@
 from game import Agent
 from game import Actions
 from game import Directions
-import random
+from game import Configuration
+import random, collections
 from util import manhattanDistance
 import util
 
+# Ghost distributions only depend on a few features of the state, so the
+# ghosts below keep them in a table per layout and policy, keyed by those
+# features (see getDistributionKey).  A table is emptied when it reaches
+# MAX_CACHED_DISTRIBUTIONS entries, and only the MAX_CACHED_TABLES most
+# recently used tables are kept, so runs over many layouts stay bounded.
+MAX_CACHED_DISTRIBUTIONS = 100000
+MAX_CACHED_TABLES = 16
+DISTRIBUTION_CACHES = collections.OrderedDict() # least recently used first
+_lastTable = (None, None) # key and table of the last lookup, read and replaced as one
+
+def getDistributionCache( layout, policy ):
+    global _lastTable
+    key = (layout.getHash(), policy)
+    lastKey, lastCache = _lastTable
+    if key == lastKey: return lastCache
+    cache = DISTRIBUTION_CACHES.pop( key, None )
+    if cache == None:
+        cache = {}
+        if len(DISTRIBUTION_CACHES) >= MAX_CACHED_TABLES: DISTRIBUTION_CACHES.popitem( last=False )
+    DISTRIBUTION_CACHES[key] = cache
+    _lastTable = (key, cache)
+    return cache
+
+def makeSamplingTable( dist ):
+    """
+    Turns a Counter into (values, cumulative probabilities), from which
+    sampleTable draws exactly the value util.sample would draw from it
+    with the same random number.
+    """
+    items = sorted( dist.items() )
+    distribution = [item[1] for item in items]
+    values = [item[0] for item in items]
+    if len(values) > 0 and sum( distribution ) != 1:
+        distribution = util.normalize( distribution )
+    totals = []
+    total = 0.0
+    for probability in distribution:
+        total += probability
+        totals.append( total )
+    return values, totals
+
+def sampleTable( table, rng=random ):
+    values, totals = table
+    choice = rng.random()
+    i = 0
+    while choice > totals[i]:
+        i += 1
+    return values[i]
+
 class GhostAgent( Agent ):
+    precomputePacman = False # whether precompute has to vary Pacman's position
+
     def __init__( self, index ):
         self.index = index
 
     def getAction( self, state ):
-        dist = self.getDistribution(state)
-        if len(dist) == 0:
+        # the keys leave out the end of the game, where no action is legal
+        if state.isWin() or state.isLose(): return Directions.STOP
+        key = self.getDistributionKey( state )
+        if key == None:
+            dist = self.getDistribution(state)
+            if len(dist) == 0:
+                return Directions.STOP
+            else:
+                return util.chooseFromDistribution( dist, state.getRandom() )
+
+        cache = getDistributionCache( state.data.layout, self.getPolicyKey() )
+        table = cache.get( key )
+        if table == None:
+            if len(cache) >= MAX_CACHED_DISTRIBUTIONS: cache.clear()
+            table = cache[key] = makeSamplingTable( self.getDistribution( state ) )
+        if len(table[0]) == 0:
             return Directions.STOP
-        else:
-            return util.chooseFromDistribution( dist )
+        return sampleTable( table, state.getRandom() )
 
     def getDistribution(self, state):
         "Returns a Counter encoding a distribution over actions from the provided state."
         util.raiseNotDefined()
 
+    def getDistributionKey( self, state ):
+        """
+        Returns everything getDistribution depends on in state as a hashable
+        key, or None if distributions must not be cached.  Subclasses that
+        change getDistribution must change this too.
+        """
+        return None
+
+    def getPolicyKey( self ):
+        "Identifies the ghost's parameters; ghosts with equal keys share tables."
+        return (self.__class__.__name__,)
+
+    def precompute( self, layout, pacmanPositions=None ):
+        """
+        Fills the distribution table of layout for every open cell, direction
+        and scared flag of this ghost (and, if the distribution depends on
+        Pacman, every Pacman position in pacmanPositions, by default every
+        open cell) until the table is full.  Half-step positions of scared
+        ghosts are left to be filled as they come up.
+        """
+        import pacman
+        state = pacman.GameState()
+        state.initialize( layout, self.index )
+        if self.index >= state.getNumAgents(): return
+        cache = getDistributionCache( layout, self.getPolicyKey() )
+        cells = [(x, y) for x in range( layout.width ) for y in range( layout.height ) if not layout.walls[x][y]]
+        if not self.precomputePacman: pacmanPositions = [state.getPacmanPosition()]
+        elif pacmanPositions == None: pacmanPositions = cells
+        ghostState = state.data.agentStates[self.index]
+        for pacmanPosition in pacmanPositions:
+            state.data.agentStates[0].configuration = Configuration( pacmanPosition, Directions.STOP )
+            for cell in cells:
+                for direction in Actions.DIRECTIONS:
+                    for scaredTimer in [0, 1]:
+                        if len(cache) >= MAX_CACHED_DISTRIBUTIONS: return
+                        ghostState.configuration = Configuration( cell, direction )
+                        ghostState.scaredTimer = scaredTimer
+                        key = self.getDistributionKey( state )
+                        if key not in cache: cache[key] = makeSamplingTable( self.getDistribution( state ) )
+
 class RandomGhost( GhostAgent ):
     "A ghost that chooses a legal action uniformly at random."
+    def getDistributionKey( self, state ):
+        configuration = state.data.agentStates[self.index].configuration
+        return configuration.pos, configuration.direction
+
     def getDistribution( self, state ):
         dist = util.Counter()
         for a in state.getLegalActions( self.index ): dist[a] = 1.0
@@ -44,11 +153,22 @@ class RandomGhost( GhostAgent ):
 
 class DirectionalGhost( GhostAgent ):
     "A ghost that prefers to rush Pacman, or flee when scared."
+    precomputePacman = True
+
     def __init__( self, index, prob_attack=0.8, prob_scaredFlee=0.8 ):
         self.index = index
         self.prob_attack = prob_attack
         self.prob_scaredFlee = prob_scaredFlee
 
+    def getDistributionKey( self, state ):
+        ghostState = state.data.agentStates[self.index]
+        configuration = ghostState.configuration
+        return (configuration.pos, configuration.direction, ghostState.scaredTimer > 0,
+                state.data.agentStates[0].configuration.pos)
+
+    def getPolicyKey( self ):
+        return (self.__class__.__name__, self.prob_attack, self.prob_scaredFlee)
+
     def getDistribution( self, state ):
         # Read variables from state
         ghostState = state.getGhostState( self.index )
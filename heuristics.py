@@ -12,3 +12,16 @@ def admissibleHeuristic(state):
     if state.isLose():
         return 1000.0;
     return state.getNumFood() + len(state.getCapsules());
+
+# maze distance to the closest food plus one step for each other food and
+# capsule, for the *Search layouts; each step eats at most one of them
+def nearestFoodHeuristic(state):
+    if state.isLose():
+        return 1000.0;
+    foodIndex = state.getFoodIndex()
+    if foodIndex.count == 0:
+        return len(state.getCapsules());
+    nearest = foodIndex.getNearest(state.getPacmanPosition(), state.getWalls())
+    if nearest == None:
+        return 1000.0;
+    return nearest[0] + foodIndex.count - 1 + len(state.getCapsules());
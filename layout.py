@@ -14,52 +14,76 @@
 
 from util import manhattanDistance
 from game import Grid
+from game import Actions
+from visibility import getVisibility
 import os
 import random
+import struct, json, mmap, hashlib, tempfile
 
-VISIBILITY_MATRIX_CACHE = {}
+LAYOUT_CACHE = {}
+LAYOUT_FILE_CACHE = {} # absolute path -> ((mtime, size), Layout)
+
+# Compiled layouts (<name>.layc next to <name>.lay) are
+#   COMPILED_MAGIC | version (1 byte) | header length (4 bytes, big endian)
+#   | header (JSON) | walls | food
+# where the grids are in the format of Grid.packBytes.  The header holds
+# everything else the Layout needs and the SHA-1 of the .lay file it was
+# compiled from.
+COMPILED_MAGIC = 'PMLC'
+COMPILED_VERSION = 1
+_COMPILED_PREAMBLE = struct.Struct('>4sBI')
 
 class Layout:
     """
     A Layout manages the static information about the game board.
+
+    Layouts are never modified once built, so a single instance is shared by
+    every game state of every game that uses it (see internLayout).
+
+    compiled, when given, holds what parsing layoutText would give
+    (walls, food, capsules, agentPositions, numGhosts, totalFood); see
+    readCompiled.
     """
 
-    def __init__(self, layoutText):
+    def __init__(self, layoutText, compiled=None):
         self.width = len(layoutText[0])
         self.height= len(layoutText)
-        self.walls = Grid(self.width, self.height, False)
-        self.food = Grid(self.width, self.height, False)
-        self.capsules = []
-        self.agentPositions = []
-        self.numGhosts = 0
-        self.processLayoutText(layoutText)
+        if compiled == None:
+            self.walls = Grid(self.width, self.height, False)
+            self.food = Grid(self.width, self.height, False)
+            self.capsules = []
+            self.agentPositions = []
+            self.numGhosts = 0
+            self.processLayoutText(layoutText)
+            self.totalFood = len(self.food.asList())
+        else:
+            self.walls, self.food, self.capsules, self.agentPositions, self.numGhosts, self.totalFood = compiled
         self.layoutText = layoutText
-        self.totalFood = len(self.food.asList())
-        # self.initializeVisibilityMatrix()
+        self.name = None # the name it was first loaded by, see getLayout
+        self._hash = None
+        self._legalMasks = None
 
     def getNumGhosts(self):
         return self.numGhosts
 
+    def getHash(self):
+        """
+        A hex digest of the layout text that identifies the layout in game
+        records, whatever file it was loaded from.
+        """
+        if self._hash == None:
+            self._hash = hashlib.sha1("\n".join(self.layoutText)).hexdigest()
+        return self._hash
+
+    def getLegalMasks(self):
+        "The legal action mask of every cell (see Actions.computeLegalMasks), built on first use."
+        if self._legalMasks == None:
+            self._legalMasks = Actions.computeLegalMasks(self.walls)
+        return self._legalMasks
+
     def initializeVisibilityMatrix(self):
-        global VISIBILITY_MATRIX_CACHE
-        if reduce(str.__add__, self.layoutText) not in VISIBILITY_MATRIX_CACHE:
-            from game import Directions
-            vecs = [(-0.5,0), (0.5,0),(0,-0.5),(0,0.5)]
-            dirs = [Directions.NORTH, Directions.SOUTH, Directions.WEST, Directions.EAST]
-            vis = Grid(self.width, self.height, {Directions.NORTH:set(), Directions.SOUTH:set(), Directions.EAST:set(), Directions.WEST:set(), Directions.STOP:set()})
-            for x in range(self.width):
-                for y in range(self.height):
-                    if self.walls[x][y] == False:
-                        for vec, direction in zip(vecs, dirs):
-                            dx, dy = vec
-                            nextx, nexty = x + dx, y + dy
-                            while (nextx + nexty) != int(nextx) + int(nexty) or not self.walls[int(nextx)][int(nexty)] :
-                                vis[x][y][direction].add((nextx, nexty))
-                                nextx, nexty = x + dx, y + dy
-            self.visibility = vis
-            VISIBILITY_MATRIX_CACHE[reduce(str.__add__, self.layoutText)] = vis
-        else:
-            self.visibility = VISIBILITY_MATRIX_CACHE[reduce(str.__add__, self.layoutText)]
+        "Loads or builds the line of sight table of first-person mode (see visibility.py)."
+        self.visibility = getVisibility(self)
 
     def isWall(self, pos):
         x, col = pos
@@ -83,14 +107,14 @@ class Layout:
         return pos
 
     def isVisibleFrom(self, ghostPos, pacPos, pacDirection):
-        row, col = [int(x) for x in pacPos]
-        return ghostPos in self.visibility[row][col][pacDirection]
+        return getVisibility(self).isVisibleFrom(ghostPos, pacPos, pacDirection)
 
     def __str__(self):
         return "\n".join(self.layoutText)
 
     def deepCopy(self):
-        return Layout(self.layoutText[:])
+        # Layouts are immutable; copies would only re-parse the same text
+        return self
 
     def processLayoutText(self, layoutText):
         """
@@ -129,21 +153,132 @@ class Layout:
             self.agentPositions.append( (int(layoutChar), (x,y)))
             self.numGhosts += 1
 def getLayout(name, back = 2):
-    if name.endswith('.lay'):
-        layout = tryToLoad('layouts/' + name)
-        if layout == None: layout = tryToLoad(name)
-    else:
-        layout = tryToLoad('layouts/' + name + '.lay')
-        if layout == None: layout = tryToLoad(name + '.lay')
-    if layout == None and back >= 0:
-        curdir = os.path.abspath('.')
-        os.chdir('..')
-        layout = getLayout(name, back -1)
-        os.chdir(curdir)
+    """
+    Loads the layout called name: layouts/<name>.lay or <name>.lay (name may
+    also end in .lay), looked up in the current directory and then in up to
+    back + 1 directories above it.
+    """
+    if not name.endswith('.lay'): fileName = name + '.lay'
+    else: fileName = name
+    layout = None
+    for level in range(back + 2):
+        parent = os.path.join(*(['.'] + ['..'] * level))
+        for path in [os.path.join(parent, 'layouts', fileName), os.path.join(parent, fileName)]:
+            layout = tryToLoad(path)
+            if layout != None: break
+        if layout != None: break
+    if layout != None and layout.name == None: layout.name = name
     return layout
 
+def findLayout(layoutHash, directory='layouts'):
+    """
+    Returns the layout in directory whose getHash() is layoutHash, or None.
+    """
+    if not os.path.isdir(directory): return None
+    for fileName in sorted(os.listdir(directory)):
+        if not fileName.endswith('.lay'): continue
+        layout = tryToLoad(os.path.join(directory, fileName))
+        if layout != None and layout.getHash() == layoutHash:
+            if layout.name == None: layout.name = fileName[:-4]
+            return layout
+    return None
+
+def internLayout(layoutText):
+    """
+    Returns the shared Layout for layoutText, parsing it only the first time.
+    """
+    key = tuple(layoutText)
+    if key not in LAYOUT_CACHE:
+        LAYOUT_CACHE[key] = Layout(list(layoutText))
+    return LAYOUT_CACHE[key]
+
 def tryToLoad(fullname):
+    """
+    Loads the layout file fullname, or returns None if there is none.  Every
+    file is loaded once per process (again only when it changes), and from
+    its compiled form when that is up to date; otherwise the text is parsed
+    and compiled for next time.
+    """
     if(not os.path.exists(fullname)): return None
-    f = open(fullname)
-    try: return Layout([line.strip() for line in f])
+    path = os.path.abspath(fullname)
+    info = os.stat(path)
+    version = (info.st_mtime, info.st_size)
+    cached = LAYOUT_FILE_CACHE.get(path)
+    if cached != None and cached[0] == version: return cached[1]
+
+    f = open(path, 'rb')
+    try: source = f.read()
     finally: f.close()
+    # The lines as iterating over the file gives them
+    lines = source.split('\n')
+    if len(lines) > 1 and lines[-1] == '': lines.pop()
+    layoutText = [line.strip() for line in lines]
+    sourceHash = hashlib.sha1(source).hexdigest()
+
+    compiledName = compiledFileName(path)
+    layout = readCompiled(compiledName, layoutText, sourceHash)
+    if layout == None:
+        layout = internLayout(layoutText)
+        writeCompiled(compiledName, layout, sourceHash)
+    else:
+        layout = LAYOUT_CACHE.setdefault(tuple(layoutText), layout)
+    LAYOUT_FILE_CACHE[path] = (version, layout)
+    return layout
+
+def compiledFileName(fileName):
+    return os.path.splitext(fileName)[0] + '.layc'
+
+def writeCompiled(fileName, layout, sourceHash):
+    """
+    Writes the compiled form of layout, made from the file whose SHA-1 is
+    sourceHash, to fileName.  Does nothing if the file cannot be written.
+    """
+    header = json.dumps({'sourceHash': sourceHash, 'hash': layout.getHash(),
+                         'width': layout.width, 'height': layout.height,
+                         'capsules': layout.capsules, 'agentPositions': layout.agentPositions,
+                         'numGhosts': layout.numGhosts, 'totalFood': layout.totalFood}, sort_keys=True)
+    temporary = None
+    try:
+        handle, temporary = tempfile.mkstemp('.tmp', os.path.basename(fileName), os.path.dirname(fileName) or '.')
+        f = os.fdopen(handle, 'wb')
+        try:
+            f.write(_COMPILED_PREAMBLE.pack(COMPILED_MAGIC, COMPILED_VERSION, len(header)))
+            f.write(header)
+            f.write(layout.walls.packBytes())
+            f.write(layout.food.packBytes())
+        finally: f.close()
+        os.rename(temporary, fileName)
+    except (IOError, OSError):
+        if temporary != None and os.path.exists(temporary): os.remove(temporary)
+
+def readCompiled(fileName, layoutText, sourceHash):
+    """
+    The Layout of layoutText from the compiled file fileName, read through a
+    memory map, or None if there is no such file or it was compiled from a
+    different source or by a different version.
+    """
+    if not os.path.exists(fileName): return None
+    f = open(fileName, 'rb')
+    try:
+        if os.fstat(f.fileno()).st_size < _COMPILED_PREAMBLE.size: return None
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    finally: f.close()
+    try:
+        magic, version, headerLength = _COMPILED_PREAMBLE.unpack(data[:_COMPILED_PREAMBLE.size])
+        if magic != COMPILED_MAGIC or version != COMPILED_VERSION: return None
+        start = _COMPILED_PREAMBLE.size
+        try: header = json.loads(data[start:start + headerLength])
+        except ValueError: return None # cut short
+        if header['sourceHash'] != sourceHash: return None
+        width, height = header['width'], header['height']
+        columnBytes = (height + 7) / 8
+        if len(data) != start + headerLength + 2 * width * columnBytes: return None
+        walls = Grid.fromBytes(data, width, height, start + headerLength)
+        food = Grid.fromBytes(data, width, height, start + headerLength + width * columnBytes)
+    finally:
+        data.close()
+    capsules = [tuple(capsule) for capsule in header['capsules']]
+    agentPositions = [(isPacman, tuple(position)) for isPacman, position in header['agentPositions']]
+    layout = Layout(layoutText, (walls, food, capsules, agentPositions, header['numGhosts'], header['totalFood']))
+    layout._hash = header['hash']
+    return layout
@@ -0,0 +1,146 @@
+# layoutGenerator.py
+# ------------------
+# Licensing Information:  You are free to use or extend these projects for
+# educational purposes provided that (1) you do not distribute or publish
+# solutions, (2) you retain this notice, and (3) you provide clear
+# attribution to UC Berkeley, including a link to http://ai.berkeley.edu.
+#
+# Attribution Information: The Pacman AI projects were developed at UC Berkeley.
+# The core projects and autograders were primarily created by John DeNero
+# (denero@cs.berkeley.edu) and Dan Klein (klein@cs.berkeley.edu).
+# Student side autograding was added by Brad Miller, Nick Hay, and
+# Pieter Abbeel (pabbeel@cs.berkeley.edu).
+
+
+"""
+LayoutGenerator.py makes random mazes of any size in the .lay format, for
+trying the engine and the agents on boards far larger than the ones in
+layouts/:
+
+  python layoutGenerator.py -W 200 -H 200 --seed 3 -o layouts/maze200.lay
+  python pacman.py -l maze200 -q
+
+The maze is carved by a depth first search over the cells at odd
+coordinates, so it is a tree of one cell wide corridors; --loops then
+knocks out that fraction of the remaining inner walls to add cycles.
+Pacman, the ghosts (never within GHOST_CLEARANCE of Pacman), the capsules
+and the food are placed on random open cells with the given densities
+(fractions of the open cells).  The same options and seed always give the
+same layout.
+"""
+
+from util import manhattanDistance
+import layout
+import sys, random
+
+GHOST_CLEARANCE = 3 # ghosts start further than this from Pacman
+
+def default(str):
+    return str + ' [Default: %default]'
+
+def carveMaze( width, height, rng, loops=0.0 ):
+    """
+    Returns walls[x][y] of a width x height maze (see the module docstring).
+    """
+    if width < 3 or height < 3: raise Exception( 'Layouts must be at least 3x3' )
+    walls = [[True] * height for x in range( width )]
+    start = (1 + 2 * rng.randint( 0, (width - 3) / 2 ), 1 + 2 * rng.randint( 0, (height - 3) / 2 ))
+    walls[start[0]][start[1]] = False
+    stack = [start]
+    while len(stack) > 0:
+        x, y = stack[-1]
+        neighbours = [(x + dx, y + dy) for dx, dy in [(2, 0), (-2, 0), (0, 2), (0, -2)]
+                      if 0 < x + dx < width - 1 and 0 < y + dy < height - 1 and walls[x + dx][y + dy]]
+        if len(neighbours) == 0:
+            stack.pop()
+            continue
+        nextX, nextY = rng.choice( neighbours )
+        walls[(x + nextX) / 2][(y + nextY) / 2] = False
+        walls[nextX][nextY] = False
+        stack.append( (nextX, nextY) )
+
+    # Walls between two cells: x even and y odd, or the other way round
+    for x in range( 1, width - 1 ):
+        for y in range( 1 + x % 2, height - 1, 2 ):
+            if not walls[x][y]: continue
+            if x % 2 == 0: between = [(x - 1, y), (x + 1, y)]
+            else: between = [(x, y - 1), (x, y + 1)]
+            if all( [0 < cx < width - 1 and 0 < cy < height - 1 and not walls[cx][cy] for cx, cy in between] ) \
+               and rng.random() < loops:
+                walls[x][y] = False
+    return walls
+
+def generateLayoutText( width, height, seed=0, loops=0.1, food=0.8, capsules=0.002, ghosts=0.002, maxGhosts=None ):
+    """
+    The lines of a random width x height layout (see the module docstring).
+    """
+    rng = random.Random( seed )
+    walls = carveMaze( width, height, rng, loops )
+    cells = [(x, y) for x in range( width ) for y in range( height ) if not walls[x][y]]
+    rng.shuffle( cells )
+    contents = {}
+    pacman = cells[0]
+    contents[pacman] = 'P'
+    free = cells[1:]
+
+    numGhosts = int( round( ghosts * len(cells) ) )
+    if maxGhosts != None: numGhosts = min( numGhosts, maxGhosts )
+    for cell in free:
+        if numGhosts == 0: break
+        if manhattanDistance( cell, pacman ) > GHOST_CLEARANCE:
+            contents[cell] = 'G'
+            numGhosts -= 1
+
+    free = [cell for cell in free if cell not in contents]
+    numCapsules = int( round( capsules * len(cells) ) )
+    for cell in free[:numCapsules]: contents[cell] = 'o'
+    for cell in free[numCapsules:]:
+        if rng.random() < food: contents[cell] = '.'
+
+    lines = []
+    for y in range( height - 1, -1, -1 ):
+        line = []
+        for x in range( width ):
+            if walls[x][y]: line.append( '%' )
+            else: line.append( contents.get( (x, y), ' ' ) )
+        lines.append( ''.join( line ) )
+    return lines
+
+def generateLayout( width, height, seed=0, **densities ):
+    """
+    A random Layout; densities are the keyword arguments of generateLayoutText.
+    """
+    result = layout.Layout( generateLayoutText( width, height, seed, **densities ) )
+    result.name = 'generated-%dx%d-%d' % (width, height, seed)
+    return result
+
+def readCommand( argv ):
+    from optparse import OptionParser
+    usageStr = """
+    USAGE:      python layoutGenerator.py <options>
+    EXAMPLE:    python layoutGenerator.py -W 200 -H 200 --seed 3 -o layouts/maze200.lay
+    """
+    parser = OptionParser(usageStr)
+    parser.add_option('-W', '--width', dest='width', type='int', help=default('Width of the layout'), default=41)
+    parser.add_option('-H', '--height', dest='height', type='int', help=default('Height of the layout'), default=21)
+    parser.add_option('-s', '--seed', dest='seed', type='int', help=default('Random seed'), default=0)
+    parser.add_option('--loops', dest='loops', type='float', help=default('Fraction of inner walls removed to make cycles'), default=0.1)
+    parser.add_option('--food', dest='food', type='float', help=default('Fraction of free cells with food'), default=0.8)
+    parser.add_option('--capsules', dest='capsules', type='float', help=default('Capsules per open cell'), default=0.002)
+    parser.add_option('--ghosts', dest='ghosts', type='float', help=default('Ghosts per open cell'), default=0.002)
+    parser.add_option('--maxGhosts', dest='maxGhosts', type='int', help='Place no more than this many ghosts', default=None)
+    parser.add_option('-o', '--output', dest='output', help='Write the layout to this file instead of standard output', default=None)
+    options, otherjunk = parser.parse_args(argv)
+    if len(otherjunk) != 0:
+        raise Exception('Command line input not understood: ' + str(otherjunk))
+    return options
+
+if __name__ == '__main__':
+    options = readCommand( sys.argv[1:] )
+    lines = generateLayoutText( options.width, options.height, options.seed, options.loops,
+                                options.food, options.capsules, options.ghosts, options.maxGhosts )
+    output = sys.stdout
+    if options.output != None: output = open( options.output, 'w' )
+    try: output.write( '\n'.join( lines ) + '\n' )
+    finally:
+        if output is not sys.stdout: output.close()
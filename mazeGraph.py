@@ -0,0 +1,134 @@
+# mazeGraph.py
+# ------------
+# Licensing Information:  You are free to use or extend these projects for
+# educational purposes provided that (1) you do not distribute or publish
+# solutions, (2) you retain this notice, and (3) you provide clear
+# attribution to UC Berkeley, including a link to http://ai.berkeley.edu.
+#
+# Attribution Information: The Pacman AI projects were developed at UC Berkeley.
+# The core projects and autograders were primarily created by John DeNero
+# (denero@cs.berkeley.edu) and Dan Klein (klein@cs.berkeley.edu).
+# Student side autograding was added by Brad Miller, Nick Hay, and
+# Pieter Abbeel (pabbeel@cs.berkeley.edu).
+
+
+"""
+Static maze analysis that compresses a Layout into a graph of junctions
+joined by corridors, and a macro-successor that moves Pacman from one
+junction to the next in a single call.
+
+Most cells of a maze are corridor cells with exactly two open neighbors:
+once Pacman has entered one, the only sensible moves are to carry on or to
+turn back.  Planning over junctions instead of cells lets a search agent
+look much further ahead with the same tree size, while the forward model
+still simulates (and charges for) every single step so ghosts behave
+exactly as they would cell by cell.
+
+  graph = mazeGraph.getJunctionGraph( state.data.layout )
+  successor, steps = graph.generateMacroSuccessor( state, Directions.WEST )
+"""
+
+from game import Actions
+from game import Directions
+from util import nearestPoint
+
+JUNCTION_GRAPH_CACHE = {}
+
+class JunctionGraph:
+    """
+    Junctions are the open cells that do not have exactly two open
+    neighbors: intersections, dead ends and isolated cells.  edges maps
+    each junction to a dict {action: (path, end)} where path is the list of
+    cells walked when leaving the junction with action, ending at the
+    junction end.
+    """
+
+    def __init__(self, walls):
+        self.walls = walls
+        self.neighbors = {}
+        for x in range(walls.width):
+            for y in range(walls.height):
+                if not walls[x][y]:
+                    adjacent = Actions.getLegalNeighbors((x, y), walls)
+                    self.neighbors[(x, y)] = [cell for cell in adjacent if cell != (x, y)]
+        self.junctions = set([cell for cell, adjacent in self.neighbors.items() if len(adjacent) != 2])
+        if len(self.junctions) == 0 and len(self.neighbors) > 0:
+            # a maze made of a single loop: any cell will do
+            self.junctions.add(min(self.neighbors))
+        self.edges = {}
+        for junction in self.junctions:
+            self.edges[junction] = {}
+            for action in Actions.getPossibleActions(_StoppedAt(junction), walls):
+                if action == Directions.STOP: continue
+                self.edges[junction][action] = self._walk(junction, action)
+
+    def _walk(self, start, action):
+        path = []
+        cell = start
+        while True:
+            cell = Actions.getSuccessor(cell, action)
+            cell = (int(cell[0]), int(cell[1]))
+            path.append(cell)
+            if cell in self.junctions or cell == start:
+                return path, cell
+            action = self.getCorridorAction(cell, action)
+
+    def isJunction(self, cell):
+        return cell in self.junctions
+
+    def getCorridorAction(self, cell, heading):
+        """
+        The only forward move out of corridor cell when entered moving heading.
+        """
+        reverse = Actions.reverseDirection(heading)
+        for action in Actions.getPossibleActions(_StoppedAt(cell), self.walls):
+            if action != Directions.STOP and action != reverse:
+                return action
+        return reverse
+
+    def getEdge(self, junction, action):
+        "Returns (path, end) for leaving junction with action."
+        return self.edges[junction][action]
+
+    def getNumJunctions(self):
+        return len(self.junctions)
+
+    def generateMacroSuccessor(self, state, action):
+        """
+        Applies action and keeps Pacman moving along the corridor until he
+        reaches a junction or the game ends.  Every step goes through
+        generatePacmanSuccessor, so ghosts move after each step and the
+        budget is charged once per cell.
+
+        Returns (successor, steps); successor is None if the budget ran out.
+        """
+        if action not in state.getLegalPacmanActions():
+            # Pacman stays put, which is a one step macro-action
+            return state.generatePacmanSuccessor(action), 1
+        steps = 0
+        while True:
+            state = state.generatePacmanSuccessor(action)
+            steps += 1
+            if state is None or state.isWin() or state.isLose():
+                return state, steps
+            cell = nearestPoint(state.getPacmanPosition())
+            if cell in self.junctions:
+                return state, steps
+            action = self.getCorridorAction(cell, action)
+
+class _StoppedAt:
+    "The minimal configuration Actions.getPossibleActions needs."
+    def __init__(self, pos):
+        self.pos = pos
+
+    def getDirection(self):
+        return Directions.STOP
+
+def getJunctionGraph(layout):
+    """
+    Returns the (cached) JunctionGraph of layout.
+    """
+    key = tuple(layout.layoutText)
+    if key not in JUNCTION_GRAPH_CACHE:
+        JUNCTION_GRAPH_CACHE[key] = JunctionGraph(layout.walls)
+    return JUNCTION_GRAPH_CACHE[key]
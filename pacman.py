@@ -42,10 +42,13 @@ The keys are 'a', 's', 'd', and 'w' to move (or arrow keys).  Have fun!
 
 from game import GameStateData
 from game import Game
+from game import BudgetScheduler
+from game import GameContext
 from game import Directions
 from game import Actions
 from util import nearestPoint
 from util import manhattanDistance
+from visibility import getVisibility
 import util, layout
 import sys, types, time, random, os
 
@@ -90,14 +93,20 @@ class GameState:
         # Check that successors exist
         if self.isWin() or self.isLose(): raise Exception('Can\'t generate a successor of a terminal state.')
 
+        # Pacman does not move the ghosts, so all his successors can share
+        # the ghost cells of this state
+        if agentIndex == 0 and self.getNumAgents() > GHOST_CELLS_THRESHOLD:
+            self.data.getGhostCells()
+
         # Copy current state
         state = GameState(self)
 
         # Let agent's logic deal with its action's effects on the board
         if agentIndex == 0:  # Pacman is moving
-            state.data._eaten = [False for i in range(state.getNumAgents())]
+            state.data._eaten = [False] * state.getNumAgents()
             PacmanRules.applyAction( state, action )
         else:                # A ghost is moving
+            position = state.data.agentStates[agentIndex].configuration.pos
             GhostRules.applyAction( state, action, agentIndex )
 
         # Time passes
@@ -105,6 +114,7 @@ class GameState:
             state.data.scoreChange += -TIME_PENALTY # Penalty for waiting around
         else:
             GhostRules.decrementTimer( state.data.agentStates[agentIndex] )
+            state.data.updateGhostCell( agentIndex, position )
 
         # Resolve multi-agent effects
         GhostRules.checkDeath( state, agentIndex )
@@ -114,40 +124,98 @@ class GameState:
         state.data.score += state.data.scoreChange
         return state
 
+    def advanceGhost( self, agentIndex, action ):
+        """
+        Moves ghost agentIndex in this state itself, leaving it exactly as
+        generateSuccessor( agentIndex, action ) would have made its successor.
+        Used by the joint ghost step of Game.run.
+        """
+        if self.isWin() or self.isLose(): raise Exception('Can\'t generate a successor of a terminal state.')
+        data = self.data
+        data._foodEaten = data._foodAdded = data._capsuleEaten = None
+        data.scoreChange = 0
+        position = data.agentStates[agentIndex].configuration.pos
+        GhostRules.applyAction( self, action, agentIndex )
+        GhostRules.decrementTimer( data.agentStates[agentIndex] )
+        data.updateGhostCell( agentIndex, position )
+        GhostRules.checkDeath( self, agentIndex )
+        data._agentMoved = agentIndex
+        data.score += data.scoreChange
+
     def getLegalPacmanActions( self ):
-        actions = self.getLegalActions( 0 )
-        if Directions.STOP in actions: actions.remove(Directions.STOP)
-        return actions
+        if self.isWin() or self.isLose(): return []
+        return Actions.maskToActions( PacmanRules.getLegalMask( self ) & ~Actions.STOP_BIT )
 
     def getAllPossibleActions( self ):
         return [Directions.NORTH, Directions.SOUTH, Directions.EAST, Directions.WEST];
 
     def checkLegalAction( self, action ):
-        legal = self.getLegalActions(0);
-        if action in legal:
+        if self.isWin() or self.isLose(): return 0
+        if Actions.inMask( action, PacmanRules.getLegalMask( self ) ):
             return 1;
         return 0;
 
     def generatePacmanSuccessor( self, action ):
         if not self.checkLegalAction(action):
             action = Directions.STOP;
-        Game.currentIterations -= 1
-        if Game.currentIterations <= 0:
+        budget = self.data.context.budget
+        if budget != None and not budget.consume():
             return None
         """
         Generates the successor state after the specified pacman move
         """
+        rng = self.data.context.getRandom()
         newState = self.generateSuccessor(0, action)
+        # The ghosts move one after the other in the new state itself, which
+        # no one else has seen yet: one state copy per call, not one per agent
         for i in range(1,self.getNumAgents()):
-            actions = newState.getLegalActions(i)
             if newState.isWin() or newState.isLose():
                 break;
+            actions = Actions.maskToActions( GhostRules.getLegalMask( newState, i ) )
             if len(actions) > 0:
-                newState = newState.generateSuccessor(i, actions[random.randint(0, len(actions) - 1)])
+                newState.advanceGhost(i, actions[rng.randint(0, len(actions) - 1)])
             else:
-                newState = newState.generateSuccessor(i, Directions.STOP)
+                newState.advanceGhost(i, Directions.STOP)
         return newState
 
+    def getRandom( self ):
+        """
+        Returns the random number source used by the forward model: either
+        the random module itself or a util.RandomStream.
+        """
+        return self.data.context.getRandom()
+
+    def setRandom( self, rng ):
+        """
+        Makes this state and every state generated from it draw ghost moves
+        from rng (e.g. util.RandomStream(seed)) instead of the global random
+        module.  Agents can call this on the state they are given to get a
+        reproducible per-search stream without affecting the real game.
+        """
+        self.data.context = self.data.context.withRandom( rng )
+
+    def getBudget( self ):
+        """
+        Returns the game's BudgetScheduler (see game.py), or None outside a
+        game.  getBudget().getRemaining() tells how many more calls to
+        generatePacmanSuccessor the current move may make.
+        """
+        return self.data.context.budget
+
+    def getDeadline( self ):
+        """
+        Returns the util.Deadline of the move being decided, or None when
+        moves are not timed (games run without --catchExceptions).  Its soft
+        deadline is the move warning time, its hard one the move timeout.
+        """
+        return util.currentDeadline()
+
+    def getContext( self ):
+        """
+        Returns the GameContext (see game.py) shared by all states of this game.
+        """
+        return self.data.context
+
     def getPacmanState( self ):
         """
         Returns an AgentState object for pacman (in game.py)
@@ -176,6 +244,16 @@ class GameState:
     def getGhostPositions(self):
         return [s.getPosition() for s in self.getGhostStates()]
 
+    def getVisibleGhosts( self ):
+        """
+        Returns the states of the ghosts Pacman can see ahead of him in
+        first-person mode (see visibility.py).
+        """
+        pacman = self.data.agentStates[0].configuration
+        visible = getVisibility( self.data.layout )
+        return [ghost for ghost in self.getGhostStates()
+                if visible.isVisibleFrom( ghost.getPosition(), pacman.pos, pacman.direction )]
+
     def getNumAgents( self ):
         return len( self.data.agentStates )
 
@@ -189,7 +267,15 @@ class GameState:
         return self.data.capsules
 
     def getNumFood( self ):
-        return self.data.food.count()
+        return self.data.getFoodIndex().count
+
+    def getFoodIndex( self ):
+        """
+        Returns a game.FoodIndex of the remaining food: its count, asList()
+        and getNearest( position, walls ), the closest food by maze
+        distance.
+        """
+        return self.data.getFoodIndex()
 
     def getFood(self):
         """
@@ -246,6 +332,15 @@ class GameState:
         state.data = self.data.deepCopy()
         return state
 
+    def makeObservation( self, agentIndex ):
+        """
+        Returns the view of this state handed to agent agentIndex.  It is a
+        cheap copy: capsules are copied, but the agent states, the food grid
+        and the layout are shared with the game and must be treated as
+        read-only.  The engine itself never modifies them in place.
+        """
+        return GameState( self )
+
     def __eq__( self, other ):
         """
         Allows two states to be compared.
@@ -276,6 +371,7 @@ class GameState:
 
 SCARED_TIME = 40    # Moves ghosts are scared
 COLLISION_TOLERANCE = 0.7 # How close ghosts must be to Pacman to kill
+GHOST_CELLS_THRESHOLD = 8 # With more agents, collisions are looked up in the ghost cells
 TIME_PENALTY = 0 # Number of points lost each round
 
 class ClassicGameRules:
@@ -283,14 +379,25 @@ class ClassicGameRules:
     These game rules manage the control flow of a game, deciding when
     and how the game starts and ends.
     """
-    def __init__(self, timeout=1):
+    def __init__(self, timeout=1, iterations=1000, totalIterations=None, timeBudget=False, carryBudget=False, jointGhosts=False):
         self.timeout = timeout
+        self.iterations = iterations
+        self.totalIterations = totalIterations
+        self.timeBudget = timeBudget
+        self.carryBudget = carryBudget
+        self.jointGhosts = jointGhosts
 
-    def newGame( self, layout, pacmanAgent, ghostAgents, display, quiet = False, catchExceptions=False):
+    def newGame( self, layout, pacmanAgent, ghostAgents, display, quiet = False, catchExceptions=False, rng=None):
         agents = [pacmanAgent] + ghostAgents[:layout.getNumGhosts()]
         initState = GameState()
         initState.initialize( layout, len(ghostAgents) )
+        totalTime = None
+        if self.timeBudget: totalTime = self.getMaxTotalTime(0)
+        budget = BudgetScheduler( self.iterations, self.totalIterations, totalTime, self.carryBudget )
+        initState.data.context = GameContext( budget, rng, self.timeout )
         game = Game(agents, display, self, catchExceptions=catchExceptions)
+        # displays draw one agent's move per update, so only headless games step jointly
+        game.jointGhostStep = self.jointGhosts and not catchExceptions and display.checkNullDisplay()
         game.state = initState
         self.initialState = initState.deepCopy()
         self.quiet = quiet
@@ -346,18 +453,25 @@ class PacmanRules:
         """
         Returns a list of possible actions.
         """
-        return Actions.getPossibleActions( state.getPacmanState().configuration, state.data.layout.walls )
+        return Actions.maskToActions( PacmanRules.getLegalMask( state ) )
     getLegalActions = staticmethod( getLegalActions )
 
+    def getLegalMask( state ):
+        """
+        Returns the possible actions as a mask (see game.Actions).
+        """
+        layout = state.data.layout
+        return Actions.getLegalMask( state.data.agentStates[0].configuration, layout.walls, layout.getLegalMasks() )
+    getLegalMask = staticmethod( getLegalMask )
+
     def applyAction( state, action ):
         """
         Edits the state to reflect the results of the action.
         """
-        legal = PacmanRules.getLegalActions( state )
-        if action not in legal:
+        if not Actions.inMask( action, PacmanRules.getLegalMask( state ) ):
             action = Directions.STOP;
 
-        pacmanState = state.data.agentStates[0]
+        pacmanState = state.data.ownAgentState( 0 )
 
         # Update Configuration
         vector = Actions.directionToVector( action, PacmanRules.PACMAN_SPEED )
@@ -376,10 +490,11 @@ class PacmanRules:
         # Eat food
         if state.data.food[x][y]:
             state.data.scoreChange += 10
-            state.data.food = state.data.food.copy()
+            foodIndex = state.data.getFoodIndex()
+            state.data.food = state.data.food.copyColumn( x )
             state.data.food[x][y] = False
+            state.data._foodIndex = foodIndex.remove( position, state.data.food.data )
             state.data._foodEaten = position
-            # TODO: cache numFood?
             numFood = state.getNumFood()
             if numFood == 0 and not state.data._lose:
                 state.data.scoreChange += 500
@@ -390,7 +505,7 @@ class PacmanRules:
             state.data._capsuleEaten = position
             # Reset all ghosts' scared timers
             for index in range( 1, len( state.data.agentStates ) ):
-                state.data.agentStates[index].scaredTimer = SCARED_TIME
+                state.data.ownAgentState( index ).scaredTimer = SCARED_TIME
     consume = staticmethod( consume )
 
 class GhostRules:
@@ -403,23 +518,28 @@ class GhostRules:
         Ghosts cannot stop, and cannot turn around unless they
         reach a dead end, but can turn 90 degrees at intersections.
         """
-        conf = state.getGhostState( ghostIndex ).configuration
-        possibleActions = Actions.getPossibleActions( conf, state.data.layout.walls )
-        reverse = Actions.reverseDirection( conf.direction )
-        if Directions.STOP in possibleActions:
-            possibleActions.remove( Directions.STOP )
-        if reverse in possibleActions and len( possibleActions ) > 1:
-            possibleActions.remove( reverse )
-        return possibleActions
+        return Actions.maskToActions( GhostRules.getLegalMask( state, ghostIndex ) )
     getLegalActions = staticmethod( getLegalActions )
 
+    def getLegalMask( state, ghostIndex ):
+        """
+        Returns the legal actions as a mask (see game.Actions).
+        """
+        conf = state.getGhostState( ghostIndex ).configuration
+        layout = state.data.layout
+        mask = Actions.getLegalMask( conf, layout.walls, layout.getLegalMasks() ) & ~Actions.STOP_BIT
+        reverseBit = 1 << Actions.REVERSE_CODES[Actions.CODES[conf.direction]]
+        if mask & reverseBit and mask != reverseBit:
+            mask &= ~reverseBit
+        return mask
+    getLegalMask = staticmethod( getLegalMask )
+
     def applyAction( state, action, ghostIndex):
 
-        legal = GhostRules.getLegalActions( state, ghostIndex )
-        if action not in legal:
+        if not Actions.inMask( action, GhostRules.getLegalMask( state, ghostIndex ) ):
             raise Exception("Illegal ghost action " + str(action))
 
-        ghostState = state.data.agentStates[ghostIndex]
+        ghostState = state.data.ownAgentState( ghostIndex )
         speed = GhostRules.GHOST_SPEED
         if ghostState.scaredTimer > 0: speed /= 2.0
         vector = Actions.directionToVector( action, speed )
@@ -436,11 +556,11 @@ class GhostRules:
     def checkDeath( state, agentIndex):
         pacmanPosition = state.getPacmanPosition()
         if agentIndex == 0: # Pacman just moved; Anyone can kill him
-            for index in range( 1, len( state.data.agentStates ) ):
+            for index in GhostRules.getNearbyGhosts( state, pacmanPosition ):
                 ghostState = state.data.agentStates[index]
                 ghostPosition = ghostState.configuration.getPosition()
                 if GhostRules.canKill( pacmanPosition, ghostPosition ):
-                    GhostRules.collide( state, ghostState, index )
+                    GhostRules.collide( state, state.data.ownAgentState( index ), index )
         else:
             ghostState = state.data.agentStates[agentIndex]
             ghostPosition = ghostState.configuration.getPosition()
@@ -448,10 +568,31 @@ class GhostRules:
                 GhostRules.collide( state, ghostState, agentIndex )
     checkDeath = staticmethod( checkDeath )
 
+    def getNearbyGhosts( state, pacmanPosition ):
+        """
+        The indices, in order, of the ghosts that might be within
+        COLLISION_TOLERANCE of Pacman (on his grid point).  With many ghosts
+        they are looked up in the cells around Pacman in the state's ghost
+        cells instead of checking every ghost.
+        """
+        numAgents = len( state.data.agentStates )
+        if numAgents <= GHOST_CELLS_THRESHOLD: return range( 1, numAgents )
+        cells = state.data.getGhostCells()
+        x, y = nearestPoint( pacmanPosition )
+        nearby = []
+        for cell in [(x - 1, y - 1), (x - 1, y), (x - 1, y + 1), (x, y - 1), (x, y),
+                     (x, y + 1), (x + 1, y - 1), (x + 1, y), (x + 1, y + 1)]:
+            if cell in cells: nearby.extend( cells[cell] )
+        nearby.sort()
+        return nearby
+    getNearbyGhosts = staticmethod( getNearbyGhosts )
+
     def collide( state, ghostState, agentIndex):
         if ghostState.scaredTimer > 0:
             state.data.scoreChange += 200
+            position = ghostState.configuration.pos
             GhostRules.placeGhost(state, ghostState)
+            state.data.updateGhostCell( agentIndex, position )
             ghostState.scaredTimer = 0
             # Added for first-person
             state.data._eaten[agentIndex] = True
@@ -527,7 +668,13 @@ def readCommand( argv ):
     parser.add_option('-r', '--recordActions', action='store_true', dest='record',
                       help='Writes game histories to a file (named by the time they were played)', default=False)
     parser.add_option('--replay', dest='gameToReplay',
-                      help='A recorded game file (pickle) to replay', default=None)
+                      help='A recorded game file (see gameRecord.py) to replay', default=None)
+    parser.add_option('--archive', dest='archive',
+                      help='Append every game to the indexed archive ARCHIVE (see gameArchive.py)', metavar='ARCHIVE', default=None)
+    parser.add_option('--replayGame', dest='replayGame', type='int',
+                      help=default('The game to replay when --replay names an archive (its number in the latest run that played one)'), metavar='GAME', default=0)
+    parser.add_option('--replayFrom', dest='replayFrom', type='int',
+                      help='Start the replay at this PLY, seeking to it through the keyframes', metavar='PLY', default=0)
     parser.add_option('-a','--agentArgs',dest='agentArgs',
                       help='Comma separated values sent to agent. e.g. "opt1=val1,opt2,opt3=val3"')
     parser.add_option('-x', '--numTraining', dest='numTraining', type='int',
@@ -536,10 +683,32 @@ def readCommand( argv ):
                       help=default('Time to delay between frames; <0 means keyboard'), default=0.04)
     parser.add_option('-c', '--catchExceptions', action='store_true', dest='catchExceptions',
                       help='Turns on exception handling and timeouts during games', default=False)
-    parser.add_option('--timeout', dest='timeout', type='int',
+    parser.add_option('--timeout', dest='timeout', type='float',
                       help=default('Maximum length of time an agent can spend computing in a single game'), default=30)
     parser.add_option('-i', '--iterations', dest='iterations', type='int',
                       help=default('Maximum length of forward model steps'), default=500)
+    parser.add_option('--carryBudget', action='store_true', dest='carryBudget',
+                      help='Carry successor calls left unused by one move over to the next', default=False)
+    parser.add_option('--budget', dest='totalIterations', type='int',
+                      help='Share this many forward model steps across the whole game instead of a fixed number per move', default=None)
+    parser.add_option('--timeBudget', action='store_true', dest='timeBudget',
+                      help='Share the --timeout seconds across the moves of a game', default=False)
+    parser.add_option('--jointGhosts', action='store_true', dest='jointGhosts',
+                      help='Move all ghosts in one joint step per ply (same games, less overhead; needs -q, ignored with -c)', default=False)
+    parser.add_option('--workers', dest='workers', type='int',
+                      help='Play the games on a pool of WORKERS processes, each game seeded from --seed', metavar='WORKERS', default=None)
+    parser.add_option('--threads', action='store_true', dest='threads',
+                      help='Use a pool of threads instead of processes for --workers', default=False)
+    parser.add_option('--seed', dest='seed', type='int',
+                      help='Master seed from which --workers or --archive derives the seed of every game', default=None)
+    parser.add_option('--rngSeed', dest='rngSeed', type='int',
+                      help='Draw ghost moves from a block-generated random stream seeded per game', default=None)
+    parser.add_option('--stats', action='store_true', dest='stats',
+                      help='Print per-agent move times, successor calls and engine time after every game', default=False)
+    parser.add_option('--statsFile', dest='statsFile',
+                      help='Write the per-agent statistics of every game to STATS_FILE as JSON', metavar='STATS_FILE', default=None)
+    parser.add_option('--profile', dest='profile',
+                      help='Profile every agent, the display and the engine separately and write the profiles to PROFILE_DIR', metavar='PROFILE_DIR', default=None)
 
     options, otherjunk = parser.parse_args(argv)
     if len(otherjunk) != 0:
@@ -587,20 +756,51 @@ def readCommand( argv ):
     args['record'] = options.record
     args['catchExceptions'] = options.catchExceptions
     args['timeout'] = options.timeout
-
-    Game.maxIterations = options.iterations
-    Game.currentIterations = Game.maxIterations
-    Game.timeLimit = options.timeout
+    args['rngSeed'] = options.rngSeed
+    args['iterations'] = options.iterations
+    args['totalIterations'] = options.totalIterations
+    args['timeBudget'] = options.timeBudget
+    args['carryBudget'] = options.carryBudget
+    args['stats'] = options.stats
+    args['statsFile'] = options.statsFile
+    args['archive'] = options.archive
+    if options.jointGhosts and not options.quietGraphics:
+        raise Exception('--jointGhosts only works without a display (-q)')
+    args['jointGhosts'] = options.jointGhosts
+    if options.profile != None: args['profile'] = options.profile
+    args['seed'] = options.seed
+    if options.workers != None:
+        if options.workers < 1: raise Exception('--workers needs at least one worker')
+        args['workers'] = options.workers
+        args['threads'] = options.threads
+        if options.seed == None:
+            args['seed'] = random.randint(0, 2 ** 31 - 1)
+            if options.fixRandomSeed: args['seed'] = 'cs188'
 
     # Special case: recorded games don't use the runGames method or args structure
     if options.gameToReplay != None:
         print 'Replaying recorded game %s.' % options.gameToReplay
+        import gameRecord, gameArchive
+        source = None
+        if gameArchive.isArchive(options.gameToReplay):
+            archive = gameArchive.GameArchive(options.gameToReplay)
+            entry = archive.findGame(options.replayGame)
+            if entry == None: raise Exception('The archive %s has no game %d' % (options.gameToReplay, options.replayGame))
+            source = archive.openGame(entry)
+        elif gameRecord.isGameRecord(options.gameToReplay):
+            source = options.gameToReplay
+        if source != None:
+            state, plies = gameRecord.replayRecord(source, args['display'], options.replayFrom)
+            print 'Replayed %d plies: score %d, %s' % (plies, state.getScore(), ['Loss', 'Win'][int(state.isWin())])
+            sys.exit(0)
+        # Records made before the binary format: a pickled layout and move list
         import cPickle
         f = open(options.gameToReplay)
         try: recorded = cPickle.load(f)
         finally: f.close()
         recorded['display'] = args['display']
-        replayGame(**recorded)
+        state = replayGame(**recorded)
+        print 'Replayed %d plies: score %d, %s' % (len(recorded['actions']), state.getScore(), ['Loss', 'Win'][int(state.isWin())])
         sys.exit(0)
 
     return args
@@ -629,9 +829,16 @@ def loadAgent(pacman, nographics):
     raise Exception('The agent ' + pacman + ' is not specified in any *Agents.py.')
 
 def replayGame( layout, actions, display ):
+    """
+    Replays a record pickled by older versions; returns the final state.
+    The agents only fill the game's slots, they never move.
+    """
     import pacmanAgents, ghostAgents
+    from layout import internLayout
+    # the pickled Layout predates the current class; rebuild it from its text
+    layout = internLayout( layout.layoutText )
     rules = ClassicGameRules()
-    agents = [pacmanAgents.GreedyAgent()] + [ghostAgents.RandomGhost(i+1) for i in range(layout.getNumGhosts()-1)] + [ghostAgents.DirectionalGhost(ayout.getNumGhosts()+1)]
+    agents = [pacmanAgents.RandomAgent()] + [ghostAgents.RandomGhost(i+1) for i in range(layout.getNumGhosts())]
     game = rules.newGame( layout, agents[0], agents[1:], display )
     state = game.state
     display.initialize(state.data)
@@ -645,13 +852,22 @@ def replayGame( layout, actions, display ):
         rules.process(state, game)
 
     display.finish()
+    return state
 
-def runGames( layout, pacman, ghosts, display, numGames, record=False, numTraining = 0, catchExceptions=False, timeout=30 ):
-    import __main__
-    __main__.__dict__['_display'] = display
+def runGames( layout, pacman, ghosts, display, numGames, record=False, numTraining = 0, catchExceptions=False, timeout=30, rngSeed=None, workers=None, seed=None, threads=False, iterations=1000, totalIterations=None, timeBudget=False, carryBudget=False, stats=False, statsFile=None, archive=None, jointGhosts=False ):
+    settings = (timeout, iterations, totalIterations, timeBudget, carryBudget, jointGhosts)
+    if workers != None:
+        return runParallelGames( layout, pacman, ghosts, display, numGames, record, numTraining, catchExceptions, settings, rngSeed, workers, seed, threads, stats, statsFile, archive )
 
-    rules = ClassicGameRules(timeout)
+    rules = ClassicGameRules(*settings)
     games = []
+    run = newRunId()
+    seeds = None
+    if archive != None:
+        # archived games are seeded one by one, as in runParallelGames, so
+        # every game can be played again from the seed in its entry
+        if seed == None: seed = random.randint( 0, 2 ** 31 - 1 )
+        seeds = gameSeeds( seed, numGames )
 
     for i in range( numGames ):
         beQuiet = i < numTraining
@@ -663,29 +879,173 @@ def runGames( layout, pacman, ghosts, display, numGames, record=False, numTraini
         else:
             gameDisplay = display
             rules.quiet = False
-        game = rules.newGame( layout, pacman, ghosts, gameDisplay, beQuiet, catchExceptions)
-        game.run()
+        rng = None
+        gameRngSeed = None
+        if rngSeed != None:
+            gameRngSeed = rngSeed + i
+            rng = util.RandomStream(gameRngSeed)
+        gameSeed = None
+        if seeds != None:
+            gameSeed = seeds[i]
+            random.seed( gameSeed )
+        game = rules.newGame( layout, pacman, ghosts, gameDisplay, beQuiet, catchExceptions, rng)
+        recordFile = None
+        if record: recordFile = recordFileName( i )
+        if record or archive != None: startRecording( game, recordFile, gameSeed, gameRngSeed, archive )
+        try: game.run()
+        finally:
+            if game.recorder != None: finishRecording( game, archive, run, i, recordFile )
         if not beQuiet: games.append(game)
 
-        if record:
-            import time, cPickle
-            fname = ('recorded-game-%d' % (i + 1)) +  '-'.join([str(t) for t in time.localtime()[1:6]])
-            f = file(fname, 'w')
-            components = {'layout': layout, 'actions': game.moveHistory}
-            cPickle.dump(components, f)
-            f.close()
+        if stats and not beQuiet: print game.stats.summary()
 
     if (numGames-numTraining) > 0:
-        scores = [game.state.getScore() for game in games]
-        wins = [game.state.isWin() for game in games]
-        winRate = wins.count(True)/ float(len(wins))
-        print 'Average Score:', sum(scores) / float(len(scores))
-        print 'Scores:       ', ', '.join([str(score) for score in scores])
-        print 'Win Rate:      %d/%d (%.2f)' % (wins.count(True), len(wins), winRate)
-        print 'Record:       ', ', '.join([ ['Loss', 'Win'][int(w)] for w in wins])
+        printSummary( [game.state.getScore() for game in games], [game.state.isWin() for game in games] )
+    if statsFile != None: writeStats( statsFile, [game.stats for game in games] )
 
     return games
 
+def recordFileName( i ):
+    import time
+    return ('recorded-game-%d' % (i + 1)) +  '-'.join([str(t) for t in time.localtime()[1:6]])
+
+def startRecording( game, fileName, seed, rngSeed, archive=None ):
+    """
+    Gives game a gameRecord.GameRecorder that writes it to fileName as it is
+    played or, when the game goes into an archive, to memory until
+    finishRecording appends it there (and writes it to fileName, if any).
+    """
+    import gameRecord, cStringIO
+    output = fileName
+    if archive != None: output = cStringIO.StringIO()
+    game.recorder = gameRecord.GameRecorder( output, game.state.data.layout, len(game.agents),
+                                             game.startingIndex, seed, rngSeed )
+
+def newRunId():
+    "An identifier for the games of one runGames call in a shared archive."
+    import uuid
+    return uuid.uuid4().hex
+
+def finishRecording( game, archive=None, run=None, gameIndex=None, fileName=None ):
+    """
+    Closes game's record; with an archive, appends it there under run and
+    its number gameIndex in the run, and also writes it to fileName if
+    given.
+    """
+    recorder = game.recorder
+    if archive != None:
+        import gameArchive
+        entry = dict( recorder.header )
+        entry.update( { 'run': run, 'game': gameIndex, 'agents': [agent.__class__.__name__ for agent in game.agents],
+                        'score': game.state.getScore(), 'win': game.state.isWin(),
+                        'plies': recorder.ply, 'crashed': game.agentCrashed } )
+        gameArchive.GameArchive( archive ).append( recorder.file.getvalue(), entry )
+        if fileName != None:
+            f = open( fileName, 'wb' )
+            try: f.write( recorder.file.getvalue() )
+            finally: f.close()
+    recorder.close()
+
+def writeStats( fileName, statsList ):
+    """
+    Writes the GameStats of a list of games to fileName as a JSON list.
+    """
+    import json
+    f = open( fileName, 'w' )
+    try: json.dump( [stats.asDict() for stats in statsList], f, indent=1 )
+    finally: f.close()
+
+def printSummary( scores, wins ):
+    winRate = wins.count(True)/ float(len(wins))
+    print 'Average Score:', sum(scores) / float(len(scores))
+    print 'Scores:       ', ', '.join([str(score) for score in scores])
+    print 'Win Rate:      %d/%d (%.2f)' % (wins.count(True), len(wins), winRate)
+    print 'Record:       ', ', '.join([ ['Loss', 'Win'][int(w)] for w in wins])
+
+class GameOutcome:
+    """
+    The part of a finished game that a worker sends back to runParallelGames.
+    """
+    def __init__( self, index, seed, game ):
+        self.index = index
+        self.seed = seed
+        self.score = game.state.getScore()
+        self.win = game.state.isWin()
+        self.moveHistory = game.moveHistory
+        self.agentCrashed = game.agentCrashed
+        self.stats = game.stats
+
+def gameSeeds( masterSeed, numGames ):
+    """
+    Derives one seed per game from masterSeed.  The seeds only depend on
+    the game's position in the run, never on which worker plays it.
+    """
+    generator = random.Random( masterSeed )
+    return [generator.randint( 0, 2 ** 31 - 1 ) for i in range( numGames )]
+
+def runSeededGame( job ):
+    """
+    Plays game number i of a parallel run from a fresh copy of the agents.
+    In a process the random module is reseeded from the game's seed; in a
+    thread, where the random module is shared, the game draws from its own
+    util.RandomStream instead (agents see it through state.getRandom()).
+    """
+    import copy
+    i, seed, layout, pacman, ghosts, display, quiet, catchExceptions, settings, rngSeed, threads, recordFile, archive, run = job
+    pacman, ghosts = copy.deepcopy( (pacman, ghosts) )
+    rng = None
+    if rngSeed != None:
+        rngSeed = rngSeed + i
+        rng = util.RandomStream(rngSeed)
+    if threads:
+        if rng == None: rng = util.RandomStream(seed)
+    else:
+        random.seed( seed )
+    rules = ClassicGameRules( *settings )
+    game = rules.newGame( layout, pacman, ghosts, display, quiet, catchExceptions, rng )
+    if recordFile != None or archive != None: startRecording( game, recordFile, seed, rngSeed, archive )
+    try: game.run()
+    finally:
+        if game.recorder != None: finishRecording( game, archive, run, i, recordFile )
+    return GameOutcome( i, seed, game )
+
+def runParallelGames( layout, pacman, ghosts, display, numGames, record, numTraining, catchExceptions, settings, rngSeed, workers, seed, threads=False, stats=False, statsFile=None, archive=None ):
+    """
+    Plays the games of runGames on a pool of worker processes (or threads).
+    Every game gets its own seed derived from seed, so the results are the
+    same for any number of workers.  With more than one worker the games are
+    played headless and quietly; only the summary is printed.
+    """
+    import textDisplay
+    jobs = []
+    run = newRunId()
+    for i, gameSeed in enumerate( gameSeeds( seed, numGames ) ):
+        beQuiet = i < numTraining or workers > 1
+        gameDisplay = display
+        if beQuiet: gameDisplay = textDisplay.NullGraphics()
+        recordFile = None
+        if record: recordFile = recordFileName( i )
+        jobs.append( (i, gameSeed, layout, pacman, ghosts, gameDisplay, beQuiet, catchExceptions, settings, rngSeed, threads, recordFile, archive, run) )
+
+    if workers > 1:
+        import multiprocessing, multiprocessing.pool
+        if threads: pool = multiprocessing.pool.ThreadPool( workers )
+        else: pool = multiprocessing.Pool( workers )
+        try: outcomes = pool.map( runSeededGame, jobs, 1 )
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        outcomes = [runSeededGame( job ) for job in jobs]
+
+    outcomes = outcomes[numTraining:]
+    if stats:
+        for outcome in outcomes: print outcome.stats.summary()
+    if len(outcomes) > 0:
+        printSummary( [outcome.score for outcome in outcomes], [outcome.win for outcome in outcomes] )
+    if statsFile != None: writeStats( statsFile, [outcome.stats for outcome in outcomes] )
+    return outcomes
+
 if __name__ == '__main__':
     """
     The main function called when pacman.py is run
@@ -698,8 +1058,9 @@ if __name__ == '__main__':
     > python pacman.py --help
     """
     args = readCommand( sys.argv[1:] ) # Get game components based on input
-    runGames( **args )
-
-    # import cProfile
-    # cProfile.run("runGames( **args )")
+    if 'profile' in args:
+        import profiler
+        profiler.profileGames( args.pop('profile'), runGames, args )
+    else:
+        runGames( **args )
     pass
@@ -15,6 +15,7 @@
 from pacman import Directions
 from game import Agent
 from heuristics import *
+import mazeGraph
 import random
 import math
 
@@ -25,10 +26,11 @@ class RandomAgent(Agent):
 
     # GetAction Function: Called with every frame
     def getAction(self, state):
+        rng = state.getRandom()
         # get all legal actions for pacman
         actions = state.getLegalPacmanActions()
         # returns random action from all the valide actions
-        return actions[random.randint(0,len(actions)-1)]
+        return actions[rng.randint(0,len(actions)-1)]
 
 class RandomSequenceAgent(Agent):
     # Initialization Function: Called one time when the game starts
@@ -40,10 +42,11 @@ class RandomSequenceAgent(Agent):
 
     # GetAction Function: Called with every frame
     def getAction(self, state):
+        rng = state.getRandom()
         # get all legal actions for pacman
         possible = state.getAllPossibleActions()
         for i in range(0,len(self.actionList)):
-            self.actionList[i] = possible[random.randint(0,len(possible)-1)]
+            self.actionList[i] = possible[rng.randint(0,len(possible)-1)]
         tempState = state
         for i in range(0,len(self.actionList)):
             if tempState.isWin() + tempState.isLose() == 0:
@@ -64,10 +67,11 @@ class HillClimberAgent(Agent):
 
     # GetAction Function: Called with every frame
     def getAction(self, state):
+        rng = state.getRandom()
         # get all legal actions for pacman
         possible = state.getAllPossibleActions()
         for i in range(0, len(self.actionList)):
-            self.actionList[i] = random.choice(possible)
+            self.actionList[i] = rng.choice(possible)
 
         # keep tracking best action list and its score
         bestScore = float('-inf')
@@ -97,8 +101,8 @@ class HillClimberAgent(Agent):
                 break
             possible = currState.getAllPossibleActions()
             for i in range(0, len(self.actionList)):
-                if random.randint(0, 1) == 1:
-                    self.actionList[i] = random.choice(possible)
+                if rng.randint(0, 1) == 1:
+                    self.actionList[i] = rng.choice(possible)
 
         return bestActionList[0]
 
@@ -110,7 +114,7 @@ class GeneticAgent(Agent):
     def selection(self, chromosomes):
         n = len(chromosomes)
         total = n * (n + 1) // 2 # sum: n + (n - 1) + ... + 1
-        rand = random.randint(1, total)
+        rand = self.rng.randint(1, total)
         # print total, rand
         sum = 0
         for i in range(0, n):
@@ -121,6 +125,7 @@ class GeneticAgent(Agent):
 
     # GetAction Function: Called with every frame
     def getAction(self, state):
+        rng = self.rng = state.getRandom()
         # get all legal actions for pacman
         possible = state.getAllPossibleActions()
         # initalially assign actions to each chromosome
@@ -130,7 +135,7 @@ class GeneticAgent(Agent):
             chromosome = []
             # Each chromosome is an action sequence of length 5
             for i in range(0, 5):
-                chromosome.append(random.choice(possible))
+                chromosome.append(rng.choice(possible))
             self.chromosomes.append(chromosome[:])
             # print chromosome
 
@@ -168,11 +173,11 @@ class GeneticAgent(Agent):
             while len(population) < len(self.chromosomes):
                 chromosome_x = self.selection(self.chromosomes)
                 chromosome_y = self.selection(self.chromosomes)
-                if random.randint(1, 10) <= 7:
+                if rng.randint(1, 10) <= 7:
                     # 70% - crossover
                     chromosome_new = []
                     for i in range(0, len(chromosome_x)):
-                        if random.randint(0, 1) == 0:
+                        if rng.randint(0, 1) == 0:
                             # 50% - choose x
                             chromosome_new.append(chromosome_x[i])
                         else:
@@ -188,10 +193,10 @@ class GeneticAgent(Agent):
 
             # mutated chromosomes
             for chromosome in population:
-                if random.randint(1, 10) == 1:
+                if rng.randint(1, 10) == 1:
                     # 10% - mutate the chromosome by random choice
-                    rand_index = random.randint(0, 4)
-                    chromosome[rand_index] = random.choice(possible)
+                    rand_index = rng.randint(0, 4)
+                    chromosome[rand_index] = rng.choice(possible)
             # new round
             self.chromosomes = population[:]
         # print self.ranked
@@ -206,17 +211,65 @@ class MCTSAgent(Agent):
             self.children = []
             self.n = 0
             self.reward = 0
+            # all-moves-as-first statistics (only used with rave)
+            self.amafN = 0
+            self.amafReward = 0
+
+    # rave=1 blends AMAF statistics into uct with weight
+    #   beta = sqrt(raveK / (3 * N(v') + raveK))
+    # so they dominate while a child has few visits and fade out afterwards
+    #
+    # earlyStop=1 ends the search as soon as one root child dominates, either
+    # because no other child can catch up in visits with the remaining budget
+    # or because its Hoeffding lower bound beats every other upper bound
+    # (earlyStopC < 1 narrows the bounds and stops sooner)
+    #
+    # macro=1 builds the tree over junctions: every tree edge follows the
+    # corridor to the next junction (see mazeGraph.py)
+    # outside a game (no budget) the search stops after this many iterations,
+    # about the default 1000 successor calls per move
+    SEARCHES_WITHOUT_BUDGET = 200
+
+    def __init__(self, index=0, rave=0, raveK=50, earlyStop=0, earlyStopC=1.0, macro=0):
+        Agent.__init__(self, index)
+        self.macro = int(macro)
+        self.rave = int(rave)
+        self.raveK = float(raveK)
+        self.earlyStop = int(earlyStop)
+        self.earlyStopC = float(earlyStopC)
+        self.moves = 0
+        self.earlyStops = 0
+        self.savedCalls = 0
 
     # Initialization Function: Called one time when the game starts
     def registerInitialState(self, state):
+        if self.macro:
+            self.graph = mazeGraph.getJunctionGraph(state.data.layout)
         return
 
     # GetAction Function: Called with every frame
     def getAction(self, state):
+        self.moves += 1
+        if self.earlyStop:
+            actions = state.getLegalPacmanActions()
+            if len(actions) == 1:
+                # nothing to decide, keep the whole budget
+                self.stopEarly(state)
+                return actions[0]
         # create the root node
         self.root_state = state
         root = self.TreeNode()
+        self.searchesLeft = None
+        if state.getBudget() is None:
+            self.searchesLeft = self.SEARCHES_WITHOUT_BUDGET
+        self.startBudget = self.getRemaining(state)
+        self.minReward = float('inf')
+        self.maxReward = float('-inf')
         while True:
+            if self.searchesLeft is not None:
+                if self.searchesLeft == 0:
+                    break
+                self.searchesLeft -= 1
             vl = self.tree_policy((root, state))
             if vl is None:
                 break
@@ -224,9 +277,59 @@ class MCTSAgent(Agent):
             if reward is None:
                 break
             self.back_up(vl[0], reward)
+            if self.earlyStop:
+                self.minReward = min(self.minReward, reward)
+                self.maxReward = max(self.maxReward, reward)
+                dominant = self.dominantChild(root)
+                if dominant is not None:
+                    self.stopEarly(state)
+                    return dominant.action
+        if len(root.children) == 0:
+            # the budget ran out before the root was expanded
+            return state.getRandom().choice(state.getLegalPacmanActions())
         # pick best child's action
         return self.uct((root, state)).action
 
+    def dominantChild(self, root):
+        # the root child that the rest of the budget can no longer change
+        children = root.children
+        if len(children) < 2 or len(root.expanded) != len(self.root_state.getLegalPacmanActions()):
+            return None
+        # visit count: iterations left, estimated from the cost so far
+        left = self.getRemaining(self.root_state)
+        spent = self.startBudget - left
+        remaining = left * root.n / float(max(spent, 1))
+        ranked = sorted(children, key = lambda child: child.n)
+        if ranked[-1].n - ranked[-2].n > remaining:
+            return ranked[-1]
+        # confidence bounds: Q(v')/N(v') +- C * R * sqrt(ln N(v) / 2 N(v'))
+        spread = self.earlyStopC * (self.maxReward - self.minReward)
+        width = lambda child: spread * math.sqrt(math.log(root.n) / (2 * child.n))
+        best = max(children, key = lambda child: child.reward / child.n)
+        lower = best.reward / best.n - width(best)
+        for child in children:
+            if child is not best and child.reward / child.n + width(child) >= lower:
+                return None
+        return best
+
+    def stopEarly(self, state):
+        self.earlyStops += 1
+        self.savedCalls += self.getRemaining(state)
+
+    def getRemaining(self, state):
+        # successor calls left this move (searches left outside a game)
+        budget = state.getBudget()
+        if budget is None:
+            return self.searchesLeft
+        return budget.getRemaining()
+
+    def final(self, state):
+        if self.earlyStop:
+            print "MCTSAgent stopped early on %d/%d moves, leaving %d successor calls unused" % (self.earlyStops, self.moves, self.savedCalls)
+        self.moves = 0
+        self.earlyStops = 0
+        self.savedCalls = 0
+
     def tree_policy(self, v):
         # v is nonterminal
         while (v[1].isWin() + v[1].isLose()) == 0:
@@ -236,7 +339,7 @@ class MCTSAgent(Agent):
             else:
                 # v is fully expanded, pick best child
                 best_child = self.uct(v)
-                v = (best_child, v[1].generatePacmanSuccessor(best_child.action))
+                v = (best_child, self.successor(v[1], best_child.action))
                 if v[1] is None:
                     return None
         return v
@@ -251,35 +354,50 @@ class MCTSAgent(Agent):
             # impossible to hit here (fully expanded)
             return None
         # not fully expanded, expand this node, choose a from untried actions
-        a = random.choice(untried)
+        a = v[1].getRandom().choice(untried)
         v[0].expanded.add(a)
         # add a new child v' to v
         child_node = self.TreeNode()
         child_node.parent = v[0]
         child_node.action = a
-        child_state = v[1].generatePacmanSuccessor(a) # use this action
+        child_state = self.successor(v[1], a) # use this action
         if child_state is None:
             return None
         v[0].children.append(child_node)
         v_prime = (child_node, child_state)
         return v_prime
 
+    def successor(self, state, action):
+        if self.macro:
+            return self.graph.generateMacroSuccessor(state, action)[0]
+        return state.generatePacmanSuccessor(action)
+
     def uct(self, v, c=1):
         if (v[1].isWin() + v[1].isLose()) > 0:
             return v[1]
         # sort by uct equation from low -> hight:
         #   Q(v')/N(v') + c * sqrt(2 ln N(v) / N(v'))
-        v[0].children.sort(key = lambda child: ((child.reward / child.n) + c * math.sqrt(2 * math.log(child.parent.n) / child.n)) if child.n > 0 else float('inf'))
+        v[0].children.sort(key = lambda child: (self.value(child) + c * math.sqrt(2 * math.log(child.parent.n) / child.n)) if child.n > 0 else float('inf'))
         return v[0].children[-1]
 
+    def value(self, child):
+        # mean reward, blended with the AMAF mean when rave is on
+        q = child.reward / child.n
+        if not self.rave or child.amafN == 0:
+            return q
+        beta = math.sqrt(self.raveK / (3 * child.n + self.raveK))
+        return (1 - beta) * q + beta * (child.amafReward / child.amafN)
+
     def default_policy(self, state, rollouts=5):
         # Fix the number of rollouts to 5 as its hard to 
         # reach a terminal state in small amount of time
         curr = state
+        self.played = set() # actions of this rollout, for AMAF
         while (curr.isWin() + curr.isLose() == 0) and (rollouts > 0):
             rollouts -= 1
             actions = curr.getLegalPacmanActions()
-            action = random.choice(actions) # choose action uniformly at random
+            action = curr.getRandom().choice(actions) # choose action uniformly at random
+            self.played.add(action)
             curr = curr.generatePacmanSuccessor(action) # apply action
             if curr is None:
                 return None
@@ -287,7 +405,16 @@ class MCTSAgent(Agent):
 
     def back_up(self, node, reward):
         # back up the values from the added node up the tree to the root
+        played = self.played
         while node is not None:
             node.n += 1
             node.reward += reward
+            if self.rave:
+                # every child whose action was played later in this
+                # simulation is credited as if it had been played first
+                for child in node.children:
+                    if child.action in played:
+                        child.amafN += 1
+                        child.amafReward += reward
+                played.add(node.action)
             node = node.parent
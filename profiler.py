@@ -0,0 +1,223 @@
+# profiler.py
+# -----------
+# Licensing Information:  You are free to use or extend these projects for
+# educational purposes provided that (1) you do not distribute or publish
+# solutions, (2) you retain this notice, and (3) you provide clear
+# attribution to UC Berkeley, including a link to http://ai.berkeley.edu.
+#
+# Attribution Information: The Pacman AI projects were developed at UC Berkeley.
+# The core projects and autograders were primarily created by John DeNero
+# (denero@cs.berkeley.edu) and Dan Klein (klein@cs.berkeley.edu).
+# Student side autograding was added by Brad Miller, Nick Hay, and
+# Pieter Abbeel (pabbeel@cs.berkeley.edu).
+
+
+"""
+Profiler.py implements pacman.py's --profile mode.  The run is split into
+categories, each profiled by its own cProfile.Profile:
+
+  agent-<index>-<Class>   the agent's registerInitialState, getAction and final
+  display                 the display's initialize, update and finish
+  engine                  everything else (rules, game loop, setup)
+
+Only one profile is active at a time; the wrapped methods switch to their
+category on entry and back on exit.  At the end every category is written
+to <directory>/<category>.pstats (read it with the pstats module or a
+viewer like snakeviz).  The summary times each category from timestamps
+taken where the categories change; the profiler's own work (switching and
+sampling) is left out of them and printed as a separate line.
+
+A sampling profiler runs alongside on SIGPROF (Unix, main thread only) and
+writes <directory>/stacks.collapsed: one 'category;frame;frame... count'
+line per distinct stack, the input format of flamegraph.pl and speedscope.
+"""
+
+import cProfile, pstats
+import os, sys, signal, threading, time
+
+SAMPLE_INTERVAL = 0.001 # seconds of CPU time between stack samples
+
+def _codeName( code ):
+    return '%s:%s' % (os.path.basename( code.co_filename ), code.co_name)
+
+class GameProfiler:
+    """
+    Profiles agents, display and engine separately; see the module docstring.
+    """
+    def __init__( self, sampleInterval=SAMPLE_INTERVAL ):
+        self.profiles = {'engine': cProfile.Profile()}
+        self.categories = ['engine']
+        self.times = {'engine': 0.0} # seconds spent in each category
+        self.category = None
+        self.since = None # when the current category was entered
+        self.overhead = 0.0 # seconds spent switching and sampling
+        self.sampleInterval = sampleInterval
+        self.stacks = {}
+        self.codeNames = {} # code object -> frame name, None for this file
+        self.sampling = False
+        self.ownFile = os.path.splitext( os.path.abspath( __file__ ) )[0]
+
+    def addCategory( self, category ):
+        if category not in self.profiles:
+            self.profiles[category] = cProfile.Profile()
+            self.categories.append( category )
+            self.times[category] = 0.0
+
+    def switch( self, category ):
+        """
+        Makes category's profile the active one; returns the previous category.
+        """
+        start = time.time()
+        previous = self.category
+        if previous != None:
+            self.profiles[previous].disable()
+            self.times[previous] += start - self.since
+        self.category = category
+        if category != None: self.profiles[category].enable()
+        self.since = time.time()
+        self.overhead += self.since - start
+        return previous
+
+    def wrap( self, category, function ):
+        def profiled( *args, **kwargs ):
+            previous = self.switch( category )
+            try: return function( *args, **kwargs )
+            finally: self.switch( previous )
+        return profiled
+
+    def instrument( self, category, obj, methodNames ):
+        """
+        Replaces the given methods of obj (where present) by wrappers that
+        attribute their time to category.
+        """
+        self.addCategory( category )
+        for name in methodNames:
+            if name in dir( obj ):
+                setattr( obj, name, self.wrap( category, getattr( obj, name ) ) )
+
+    def instrumentAgent( self, index, agent ):
+        self.instrument( 'agent-%d-%s' % (index, agent.__class__.__name__), agent,
+                         ['registerInitialState', 'getAction', 'final'] )
+
+    def instrumentDisplay( self, display ):
+        self.instrument( 'display', display, ['initialize', 'update', 'finish'] )
+
+    def getCodeName( self, code ):
+        "The name of code in stacks, or None for the profiler's own code."
+        if os.path.splitext( os.path.abspath( code.co_filename ) )[0] == self.ownFile: return None
+        return _codeName( code )
+
+    def sample( self, signum, frame ):
+        start = time.time()
+        names = []
+        while frame != None:
+            code = frame.f_code
+            if code not in self.codeNames: self.codeNames[code] = self.getCodeName( code )
+            name = self.codeNames[code]
+            if name != None: names.append( name )
+            frame = frame.f_back
+        names.append( self.category or 'engine' )
+        names.reverse()
+        stack = ';'.join( names )
+        if stack in self.stacks: self.stacks[stack] += 1
+        else: self.stacks[stack] = 1
+        # the time spent here does not belong to the interrupted category
+        elapsed = time.time() - start
+        self.overhead += elapsed
+        if self.since != None: self.since += elapsed
+
+    def startSampling( self ):
+        if not hasattr( signal, 'setitimer' ) or threading.currentThread().getName() != 'MainThread':
+            print >>sys.stderr, 'Stack sampling needs signal.setitimer and the main thread; no stacks.collapsed'
+            return
+        signal.signal( signal.SIGPROF, self.sample )
+        signal.siginterrupt( signal.SIGPROF, False )
+        signal.setitimer( signal.ITIMER_PROF, self.sampleInterval, self.sampleInterval )
+        self.sampling = True
+
+    def stopSampling( self ):
+        if not self.sampling: return
+        signal.setitimer( signal.ITIMER_PROF, 0 )
+        signal.signal( signal.SIGPROF, signal.SIG_DFL )
+        self.sampling = False
+
+    def run( self, function, *args, **kwargs ):
+        self.startSampling()
+        previous = self.switch( 'engine' )
+        try: return function( *args, **kwargs )
+        finally:
+            self.switch( previous )
+            self.stopSampling()
+
+    def getUsedCategories( self ):
+        "The categories whose code actually ran (e.g. not ghosts the layout has no room for)."
+        return [category for category in self.categories if len( self.profiles[category].getstats() ) > 0]
+
+    def fileName( self, directory, category ):
+        return os.path.join( directory, category + '.pstats' )
+
+    def write( self, directory ):
+        if not os.path.isdir( directory ): os.makedirs( directory )
+        for category in self.getUsedCategories():
+            self.profiles[category].dump_stats( self.fileName( directory, category ) )
+        if len(self.stacks) > 0:
+            f = open( os.path.join( directory, 'stacks.collapsed' ), 'w' )
+            try:
+                for stack in sorted( self.stacks ):
+                    f.write( '%s %d\n' % (stack, self.stacks[stack]) )
+            finally: f.close()
+
+    def getOwnFunctions( self, stats ):
+        """
+        The pstats functions that are the profiler's, or that only the
+        profiler calls, directly or through other such functions (e.g.
+        posixpath.normpath under os.path.abspath under getCodeName).
+        """
+        own = set( [function for function in stats if
+                    os.path.splitext( os.path.abspath( function[0] ) )[0] == self.ownFile] )
+        changed = True
+        while changed:
+            changed = False
+            for function, (cc, nc, tt, ct, callers) in stats.items():
+                if function in own or len(callers) == 0: continue
+                if all( [caller in own for caller in callers] ):
+                    own.add( function )
+                    changed = True
+        return own
+
+    def printSummary( self, numFunctions=5 ):
+        """
+        Prints the time of every category and its most expensive functions
+        by own time, leaving out the profiler's own functions, and then the
+        time the profiler took.
+        """
+        for category in self.getUsedCategories():
+            stats = pstats.Stats( self.profiles[category] )
+            total = self.times[category]
+            print '%-30s %9.3fs' % (category, total)
+            own = self.getOwnFunctions( stats.stats )
+            functions = [item for item in stats.stats.items() if item[0] not in own]
+            functions.sort( key=lambda item: -item[1][2] )
+            for (fileName, line, name), (cc, nc, tt, ct, callers) in functions[:numFunctions]:
+                share = 0.0
+                if total > 0: share = 100 * tt / total
+                print '    %5.1f%% %9.3fs  %s:%d(%s)' % (share, tt, os.path.basename( fileName ), line, name)
+        print '%-30s %9.3fs' % ('(profiler)', self.overhead)
+
+def profileGames( directory, runGames, args ):
+    """
+    Calls runGames(**args) with the agents and display of args instrumented,
+    then writes the profiles to directory and prints a summary.
+    """
+    if args.get( 'workers' ) != None:
+        raise Exception( '--profile cannot be combined with --workers' )
+    profiler = GameProfiler()
+    profiler.instrumentAgent( 0, args['pacman'] )
+    for i, ghost in enumerate( args['ghosts'] ):
+        profiler.instrumentAgent( i + 1, ghost )
+    profiler.instrumentDisplay( args['display'] )
+    try: return profiler.run( runGames, **args )
+    finally:
+        profiler.write( directory )
+        profiler.printSummary()
+        print 'Profiles written to %s' % directory
@@ -57,6 +57,9 @@ class PacmanGraphics:
         self.turn = 0
         self.agentCounter = 0
 
+    def checkNullDisplay(self):
+        return False
+
     def update(self, state):
         numAgents = len(state.agentStates)
         self.agentCounter = (self.agentCounter + 1) % numAgents
@@ -0,0 +1,247 @@
+# tournament.py
+# -------------
+# Licensing Information:  You are free to use or extend these projects for
+# educational purposes provided that (1) you do not distribute or publish
+# solutions, (2) you retain this notice, and (3) you provide clear
+# attribution to UC Berkeley, including a link to http://ai.berkeley.edu.
+#
+# Attribution Information: The Pacman AI projects were developed at UC Berkeley.
+# The core projects and autograders were primarily created by John DeNero
+# (denero@cs.berkeley.edu) and Dan Klein (klein@cs.berkeley.edu).
+# Student side autograding was added by Brad Miller, Nick Hay, and
+# Pieter Abbeel (pabbeel@cs.berkeley.edu).
+
+
+"""
+Tournament.py plays every combination of Pacman agent, ghost type, layout
+and seed, headless and in parallel, and reports for every agent / ghost /
+layout cell:
+
+  - the win rate and the mean score with its 95% confidence interval
+    (from Student's t; infinite for a cell of one game)
+  - the forward model throughput (successor calls per second of Pacman's
+    thinking time)
+  - percentiles of Pacman's per-move latency
+
+Every cell uses the same list of game seeds (derived from --seed), so
+agents are compared on the same games.  Results can be written as JSON and
+CSV, and compared against a JSON file from an earlier run:
+
+  python tournament.py -p MCTSAgent,GeneticAgent -g RandomGhost,DirectionalGhost \\
+      -l smallClassic,mediumClassic -s 10 --workers 4 --json results.json
+  python tournament.py ... --baseline results.json
+
+The exit status is 1 when the comparison finds a regression.
+"""
+
+import pacman, layout, textDisplay
+import sys, time, random, math
+
+def default(str):
+    return str + ' [Default: %default]'
+
+def timeActions( agent ):
+    """
+    Makes agent record how long each of its getAction calls takes, and
+    returns the list the latencies are appended to.
+    """
+    latencies = []
+    getAction = agent.getAction
+    def timedGetAction( state ):
+        start = time.time()
+        action = getAction( state )
+        latencies.append( time.time() - start )
+        return action
+    agent.getAction = timedGetAction
+    return latencies
+
+def playGame( job ):
+    """
+    Plays a single tournament game; job is a tuple so that it can be sent
+    to a worker process.
+    """
+    pacmanName, ghostName, layoutName, seed, agentArgs, numGhosts, iterations, timeout = job
+    random.seed( seed )
+    pacmanAgent = pacman.loadAgent( pacmanName, True )( **agentArgs )
+    latencies = timeActions( pacmanAgent )
+    ghostType = pacman.loadAgent( ghostName, True )
+    ghosts = [ghostType( i + 1 ) for i in range( numGhosts )]
+    rules = pacman.ClassicGameRules( timeout, iterations )
+    game = rules.newGame( layout.getLayout( layoutName ), pacmanAgent, ghosts, textDisplay.NullGraphics(), True )
+    game.run()
+    budget = game.state.getBudget()
+    return { 'score': game.state.getScore(),
+             'win': game.state.isWin(),
+             'calls': budget.usedIterations,
+             'latencies': latencies }
+
+def percentile( values, fraction ):
+    "The value below which fraction of the (sorted) values lie."
+    if len(values) == 0: return 0.0
+    return values[min( len(values) - 1, int( fraction * len(values) ) )]
+
+# Two-sided 95% critical values of Student's t for 1 to 30 degrees of freedom;
+# past that the normal value 1.96 is close enough.
+T_CRITICAL = [12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+              2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+              2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042]
+
+def tCritical( n ):
+    "The 95% critical value for the mean of n samples (infinite for one sample)."
+    if n < 2: return float('inf')
+    if n - 1 <= len(T_CRITICAL): return T_CRITICAL[n - 2]
+    return 1.96
+
+def summarize( games ):
+    """
+    Reduces the outcomes of the games of one cell to the reported statistics.
+    """
+    n = len(games)
+    scores = [game['score'] for game in games]
+    mean = sum(scores) / float(n)
+    scoreCI = float('inf')
+    if n > 1:
+        variance = sum([(score - mean) ** 2 for score in scores]) / (n - 1)
+        scoreCI = tCritical( n ) * math.sqrt( variance / n )
+    latencies = sorted( [latency for game in games for latency in game['latencies']] )
+    thinking = sum(latencies)
+    calls = sum([game['calls'] for game in games])
+    callsPerSecond = 0.0
+    if thinking > 0: callsPerSecond = calls / thinking
+    return { 'games': n,
+             'wins': len([game for game in games if game['win']]),
+             'winRate': len([game for game in games if game['win']]) / float(n),
+             'meanScore': mean,
+             'scoreCI': scoreCI,
+             'successorCalls': calls,
+             'callsPerSecond': callsPerSecond,
+             'moves': len(latencies),
+             'latencyP50': percentile( latencies, 0.5 ),
+             'latencyP90': percentile( latencies, 0.9 ),
+             'latencyP99': percentile( latencies, 0.99 ),
+             'latencyMax': percentile( latencies, 1.0 ) }
+
+def runTournament( pacmen, ghosts, layouts, seeds, agentArgs={}, numGhosts=4, iterations=500, timeout=30, workers=1 ):
+    """
+    Plays every pacman x ghost x layout x seed game and returns one result
+    dictionary per pacman x ghost x layout cell.
+    """
+    cells = [(p, g, l) for p in pacmen for g in ghosts for l in layouts]
+    jobs = [(p, g, l, seed, agentArgs, numGhosts, iterations, timeout) for p, g, l in cells for seed in seeds]
+    if workers > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool( workers )
+        try: outcomes = pool.map( playGame, jobs, 1 )
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        outcomes = [playGame( job ) for job in jobs]
+
+    results = []
+    for i, (p, g, l) in enumerate( cells ):
+        result = summarize( outcomes[i * len(seeds):(i + 1) * len(seeds)] )
+        result['pacman'], result['ghost'], result['layout'] = p, g, l
+        results.append( result )
+    return results
+
+COLUMNS = ['pacman', 'ghost', 'layout', 'games', 'wins', 'winRate', 'meanScore', 'scoreCI',
+           'successorCalls', 'callsPerSecond', 'moves', 'latencyP50', 'latencyP90', 'latencyP99', 'latencyMax']
+
+def printResults( results ):
+    print '%-16s %-16s %-16s %6s %14s %11s %9s %9s' % ('Pacman', 'Ghost', 'Layout', 'Win', 'Score', 'Calls/s', 'p50 (ms)', 'p99 (ms)')
+    for r in results:
+        print '%-16s %-16s %-16s %6.2f %7.1f+-%5.1f %11.0f %9.2f %9.2f' % (r['pacman'], r['ghost'], r['layout'], r['winRate'],
+            r['meanScore'], r['scoreCI'], r['callsPerSecond'], 1000 * r['latencyP50'], 1000 * r['latencyP99'])
+
+def writeJson( fileName, results, settings ):
+    import json
+    f = open( fileName, 'w' )
+    try: json.dump( {'settings': settings, 'results': results}, f, indent=2, sort_keys=True )
+    finally: f.close()
+
+def writeCsv( fileName, results ):
+    import csv
+    f = open( fileName, 'wb' )
+    try:
+        writer = csv.writer( f )
+        writer.writerow( COLUMNS )
+        for r in results: writer.writerow( [r[column] for column in COLUMNS] )
+    finally: f.close()
+
+def compareToBaseline( results, baselineFile, tolerance ):
+    """
+    Prints every cell that got worse than in baselineFile and returns how
+    many did.  A cell regresses when its win rate drops by more than
+    tolerance, its mean score drops by more than both confidence intervals
+    together, or its throughput or 90th percentile latency gets worse by
+    more than tolerance (relative).
+    """
+    import json
+    f = open( baselineFile )
+    try: baseline = json.load( f )['results']
+    finally: f.close()
+    baseline = dict( [((r['pacman'], r['ghost'], r['layout']), r) for r in baseline] )
+
+    regressions = 0
+    for r in results:
+        old = baseline.get( (r['pacman'], r['ghost'], r['layout']) )
+        if old == None: continue
+        problems = []
+        if old['winRate'] - r['winRate'] > tolerance:
+            problems.append( 'win rate %.2f -> %.2f' % (old['winRate'], r['winRate']) )
+        if old['meanScore'] - r['meanScore'] > old['scoreCI'] + r['scoreCI']:
+            problems.append( 'mean score %.1f -> %.1f' % (old['meanScore'], r['meanScore']) )
+        if r['callsPerSecond'] < old['callsPerSecond'] * (1 - tolerance):
+            problems.append( 'calls/s %.0f -> %.0f' % (old['callsPerSecond'], r['callsPerSecond']) )
+        if r['latencyP90'] > old['latencyP90'] * (1 + tolerance):
+            problems.append( 'p90 latency %.2fms -> %.2fms' % (1000 * old['latencyP90'], 1000 * r['latencyP90']) )
+        if len(problems) > 0:
+            regressions += 1
+            print 'REGRESSION %s / %s / %s: %s' % (r['pacman'], r['ghost'], r['layout'], '; '.join(problems))
+    if regressions == 0: print 'No regressions against %s' % baselineFile
+    return regressions
+
+def readCommand( argv ):
+    """
+    Processes the command used to run a tournament from the command line.
+    """
+    from optparse import OptionParser
+    usageStr = """
+    USAGE:      python tournament.py <options>
+    EXAMPLE:    python tournament.py -p MCTSAgent,GeneticAgent -l smallClassic,mediumClassic -s 10 --workers 4
+    """
+    parser = OptionParser(usageStr)
+    parser.add_option('-p', '--pacman', dest='pacmen', help=default('Comma separated Pacman agents from *Agents.py'), default='MCTSAgent')
+    parser.add_option('-g', '--ghosts', dest='ghosts', help=default('Comma separated ghost agents'), default='RandomGhost,DirectionalGhost')
+    parser.add_option('-l', '--layouts', dest='layouts', help=default('Comma separated layouts'), default='smallClassic,mediumClassic')
+    parser.add_option('-s', '--seeds', dest='numSeeds', type='int', help=default('Games per cell'), default=5)
+    parser.add_option('--seed', dest='seed', type='int', help=default('Master seed the game seeds are derived from'), default=0)
+    parser.add_option('-a', '--agentArgs', dest='agentArgs', help='Comma separated values sent to every Pacman agent')
+    parser.add_option('-k', '--numghosts', type='int', dest='numGhosts', help=default('The maximum number of ghosts to use'), default=4)
+    parser.add_option('-i', '--iterations', dest='iterations', type='int', help=default('Forward model steps per move'), default=500)
+    parser.add_option('--timeout', dest='timeout', type='float', help=default('Seconds a single game may last (fractions allowed)'), default=30)
+    parser.add_option('--workers', dest='workers', type='int', help=default('Number of worker processes'), default=1)
+    parser.add_option('--json', dest='json', help='Write the results to this JSON file', default=None)
+    parser.add_option('--csv', dest='csv', help='Write the results to this CSV file', default=None)
+    parser.add_option('--baseline', dest='baseline', help='Compare against the results in this JSON file', default=None)
+    parser.add_option('--tolerance', dest='tolerance', type='float', help=default('Allowed relative slowdown and win rate drop'), default=0.1)
+    options, otherjunk = parser.parse_args(argv)
+    if len(otherjunk) != 0:
+        raise Exception('Command line input not understood: ' + str(otherjunk))
+    return options
+
+if __name__ == '__main__':
+    options = readCommand( sys.argv[1:] )
+    settings = { 'pacmen': options.pacmen.split(','), 'ghosts': options.ghosts.split(','),
+                 'layouts': options.layouts.split(','),
+                 'seeds': pacman.gameSeeds( options.seed, options.numSeeds ),
+                 'agentArgs': pacman.parseAgentArgs( options.agentArgs ),
+                 'numGhosts': options.numGhosts, 'iterations': options.iterations,
+                 'timeout': options.timeout }
+    results = runTournament( workers=options.workers, **settings )
+    printResults( results )
+    if options.json != None: writeJson( options.json, results, settings )
+    if options.csv != None: writeCsv( options.csv, results )
+    if options.baseline != None and compareToBaseline( results, options.baseline, options.tolerance ) > 0:
+        sys.exit(1)
@@ -31,6 +31,12 @@ import inspect
 import heapq, random
 import cStringIO
 
+try:
+    import numpy
+    _NUMPY_ENABLED = True
+except:
+    _NUMPY_ENABLED = False
+
 
 class FixedRandom:
     def __init__(self):
@@ -127,6 +133,65 @@ class FixedRandom:
         self.random = random.Random()
         self.random.setstate(fixedState)
 
+class RandomStream:
+    """
+    A seedable source of random numbers that serves values out of
+    pre-generated blocks instead of calling into the global random module
+    once per draw.  It implements the subset of the random module interface
+    used by the forward model (random, randint, choice), so either one can be
+    handed to GameState.setRandom or to the sampling functions below.
+
+    Blocks are generated with NumPy when it is available.  Otherwise random
+    is the bound random method of a private random.Random, which is faster
+    than any block over it.  In both cases the sequence only depends on the
+    seed, so two streams built from the same seed produce the same games.
+    """
+    BLOCK_SIZE = 4096
+
+    def __init__(self, seed=None, blockSize=None):
+        if blockSize == None: blockSize = RandomStream.BLOCK_SIZE
+        self.blockSize = blockSize
+        self.seed(seed)
+
+    def seed(self, seed=None):
+        self.initialSeed = seed
+        if _NUMPY_ENABLED:
+            if seed != None: seed = hash(seed) & 0xffffffff
+            self.generator = numpy.random.RandomState(seed)
+        else:
+            self.generator = random.Random(seed)
+            self.random = self.generator.random
+        self.block = []
+        self.position = 0
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('random', None) # bound methods cannot be pickled
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if not _NUMPY_ENABLED: self.random = self.generator.random
+
+    def _refill(self):
+        self.block = self.generator.random_sample(self.blockSize).tolist()
+        self.position = 0
+
+    def random(self):
+        "Returns the next float in [0, 1) (replaced by the generator's own without NumPy)."
+        if self.position == len(self.block): self._refill()
+        value = self.block[self.position]
+        self.position += 1
+        return value
+
+    def randint(self, a, b):
+        "Returns an integer N such that a <= N <= b."
+        return a + int(self.random() * (b - a + 1))
+
+    def choice(self, seq):
+        "Returns a uniformly chosen element of the non-empty sequence seq."
+        return seq[int(self.random() * len(seq))]
+
 def manhattanDistance( xy1, xy2 ):
     "Returns the Manhattan distance between points xy1 and xy2"
     return abs( xy1[0] - xy2[0] ) + abs( xy1[1] - xy2[1] )
@@ -377,10 +442,10 @@ def normalize(vectorOrCounter):
         if s == 0: return vector
         return [el / s for el in vector]
 
-def nSample(distribution, values, n):
+def nSample(distribution, values, n, rng=random):
     if sum(distribution) != 1:
         distribution = normalize(distribution)
-    rand = [random.random() for i in range(n)]
+    rand = [rng.random() for i in range(n)]
     rand.sort()
     samples = []
     samplePos, distPos, cdf = 0,0, distribution[0]
@@ -393,14 +458,14 @@ def nSample(distribution, values, n):
             cdf += distribution[distPos]
     return samples
 
-def sample(distribution, values = None):
+def sample(distribution, values = None, rng=random):
     if type(distribution) == Counter:
         items = sorted(distribution.items())
         distribution = [i[1] for i in items]
         values = [i[0] for i in items]
     if sum(distribution) != 1:
         distribution = normalize(distribution)
-    choice = random.random()
+    choice = rng.random()
     i, total= 0, distribution[0]
     while choice > total:
         i += 1
@@ -422,15 +487,18 @@ def getProbability(value, distribution, values):
             total += prob
     return total
 
-def flipCoin( p ):
-    r = random.random()
+def flipCoin( p, rng=random ):
+    r = rng.random()
     return r < p
 
-def chooseFromDistribution( distribution ):
-    "Takes either a counter or a list of (prob, key) pairs and samples"
+def chooseFromDistribution( distribution, rng=random ):
+    """
+    Takes either a counter or a list of (prob, key) pairs and samples.
+    rng can be any object with a random() method, e.g. a RandomStream.
+    """
     if type(distribution) == dict or type(distribution) == Counter:
-        return sample(distribution)
-    r = random.random()
+        return sample(distribution, rng=rng)
+    r = rng.random()
     base = 0.0
     for prob, element in distribution:
         base += prob
@@ -505,47 +573,152 @@ def pause():
 
 # code to handle timeouts
 #
-# FIXME
-# NOTE: TimeoutFuncton is NOT reentrant.  Later timeouts will silently
-# disable earlier timeouts.  Could be solved by maintaining a global list
-# of active time outs.  Currently, questions which have test cases calling
-# this have all student code so wrapped.
+# Every TimeoutFunction call pushes a Deadline on a per-thread stack, so
+# timeouts nest: in the main thread a single SIGALRM interval timer
+# (setitimer, so fractions of a second work) is always armed for the
+# earliest hard deadline on the stack, and its handler raises for the
+# outermost deadline that has passed.  A deadline stays armed until its own
+# call returns: if the code it interrupted swallows the exception, it is
+# raised again every RERAISE_INTERVAL seconds.  The handler is installed by
+# the outermost call and the previous one restored when it returns.  Other
+# threads cannot receive signals; there the hard deadline is checked when
+# the function returns.
 #
 import signal
+import threading
 import time
+
+RERAISE_INTERVAL = 0.01 # seconds between raises of a swallowed deadline
+
 class TimeoutFunctionException(Exception):
     """Exception to raise on a timeout"""
-    pass
+    def __init__(self, deadline=None):
+        Exception.__init__(self)
+        self.deadline = deadline
+
+class Deadline:
+    """
+    The soft and hard deadline of a timed call, as time.time() values.  The
+    hard deadline is enforced by TimeoutFunction; the soft one is only a
+    hint for the code being timed, which can poll it (see currentDeadline)
+    to wrap up before it gets cut off.
+    """
+    def __init__(self, hard, soft=None):
+        self.hard = hard
+        if soft == None or soft > hard: soft = hard
+        self.soft = soft
+        self.running = True # until its call returns
+        self.nextAlarm = hard # when the handler raises for it (again)
+        self.frame = None # the frame of its TimeoutFunction call
+
+    def timeLeft(self):
+        "Seconds until the hard deadline."
+        return self.hard - time.time()
+
+    def softTimeLeft(self):
+        "Seconds until the soft deadline."
+        return self.soft - time.time()
 
+    def isSoftExpired(self):
+        return time.time() >= self.soft
+
+    def isExpired(self):
+        return time.time() >= self.hard
+
+class _DeadlineStack(threading.local):
+    def __init__(self):
+        self.deadlines = []
+
+_DEADLINES = _DeadlineStack()
+
+def currentDeadline():
+    """
+    The Deadline of the innermost TimeoutFunction call running in this
+    thread, or None when there is none.
+    """
+    running = [deadline for deadline in _DEADLINES.deadlines if deadline.running]
+    if len(running) == 0: return None
+    return running[-1]
+
+# The alarm can go off while a call is cleaning up, so the stack may briefly
+# hold deadlines that are over; only running ones arm the timer or raise.
+def _armTimer():
+    alarms = [deadline.nextAlarm for deadline in _DEADLINES.deadlines if deadline.running]
+    if len(alarms) == 0:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+    else:
+        delay = min(alarms) - time.time()
+        signal.setitimer(signal.ITIMER_REAL, max(delay, 1e-6))
+
+def _handleAlarm(signum, frame):
+    now = time.time()
+    stack = []
+    while frame != None:
+        stack.append(frame)
+        frame = frame.f_back
+    for deadline in _DEADLINES.deadlines:
+        if not deadline.running: continue
+        if deadline.frame != None and deadline.frame not in stack:
+            # its call is gone, but an interrupted cleanup left it behind
+            deadline.running = False
+        elif deadline.nextAlarm <= now:
+            deadline.nextAlarm = now + RERAISE_INTERVAL
+            _armTimer()
+            raise TimeoutFunctionException(deadline)
+    _armTimer() # woke up early; wait for the earliest deadline again
+
+def _useSignals():
+    return hasattr(signal, 'setitimer') and isinstance(threading.current_thread(), threading._MainThread)
 
 class TimeoutFunction:
-    def __init__(self, function, timeout):
+    """
+    Calls function, raising TimeoutFunctionException once it has run for
+    timeout seconds (a float).  softTimeout, if given, sets the soft
+    deadline of the call (see Deadline).  The exceptions of enclosing calls
+    whose deadlines pass meanwhile are passed on unchanged.
+    """
+    def __init__(self, function, timeout, softTimeout=None):
         self.timeout = timeout
+        self.softTimeout = softTimeout
         self.function = function
 
-    def handle_timeout(self, signum, frame):
-        raise TimeoutFunctionException()
-
     def __call__(self, *args, **keyArgs):
-        # If we have SIGALRM signal, use it to cause an exception if and
-        # when this function runs too long.  Otherwise check the time taken
-        # after the method has returned, and throw an exception then.
-        if hasattr(signal, 'SIGALRM'):
-            old = signal.signal(signal.SIGALRM, self.handle_timeout)
-            signal.alarm(self.timeout)
+        startTime = time.time()
+        soft = None
+        if self.softTimeout != None: soft = startTime + self.softTimeout
+        deadline = Deadline(startTime + self.timeout, soft)
+        deadline.frame = sys._getframe()
+        deadlines = _DEADLINES.deadlines
+        depth = len(deadlines)
+        useSignals = _useSignals()
+        handlers = []
+        if useSignals and signal.getsignal(signal.SIGALRM) != _handleAlarm:
+            handlers.append(signal.signal(signal.SIGALRM, _handleAlarm))
+        try:
             try:
+                deadlines.append(deadline)
+                if useSignals: _armTimer()
                 result = self.function(*args, **keyArgs)
             finally:
-                signal.signal(signal.SIGALRM, old)
-            signal.alarm(0)
-        else:
-            startTime = time.time()
-            result = self.function(*args, **keyArgs)
-            timeElapsed = time.time() - startTime
-            if timeElapsed >= self.timeout:
-                self.handle_timeout(None, None)
+                self._cleanUp(deadline, depth, useSignals, handlers)
+        except TimeoutFunctionException:
+            # the alarm may have cut the cleanup above short
+            self._cleanUp(deadline, depth, useSignals, handlers)
+            raise
+        # Also catches functions that swallowed the exception themselves
+        if time.time() >= deadline.hard:
+            raise TimeoutFunctionException(deadline)
         return result
 
+    def _cleanUp(self, deadline, depth, useSignals, handlers):
+        deadline.running = False
+        del _DEADLINES.deadlines[depth:]
+        if useSignals: _armTimer()
+        if len(handlers) > 0:
+            previous = handlers[0]
+            if previous == None: previous = signal.SIG_DFL # not installed from Python
+            signal.signal(signal.SIGALRM, previous)
+
 
 
 _ORIGINAL_STDOUT = None
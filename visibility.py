@@ -0,0 +1,175 @@
+# visibility.py
+# -------------
+# Licensing Information:  You are free to use or extend these projects for
+# educational purposes provided that (1) you do not distribute or publish
+# solutions, (2) you retain this notice, and (3) you provide clear
+# attribution to UC Berkeley, including a link to http://ai.berkeley.edu.
+#
+# Attribution Information: The Pacman AI projects were developed at UC Berkeley.
+# The core projects and autograders were primarily created by John DeNero
+# (denero@cs.berkeley.edu) and Dan Klein (klein@cs.berkeley.edu).
+# Student side autograding was added by Brad Miller, Nick Hay, and
+# Pieter Abbeel (pabbeel@cs.berkeley.edu).
+
+
+"""
+Line of sight for first-person mode: looking in a direction from an open
+cell, Pacman sees along its row or column up to the first wall (and
+nothing while he stands still).  Everything on that segment is visible,
+including ghosts half way between two of its cells.
+
+The cells seen along a ray are consecutive, so the line of sight of every
+cell and direction is stored as the last cell of its ray ("reach"), one
+array for the whole layout: isVisibleFrom is O(1) and the memory is four
+integers per cell.  The table is built on first use for a layout, kept
+for the rest of the process and saved in CACHE_DIRECTORY under the
+layout's hash, so later processes load it instead of building it.
+
+  visible = visibility.getVisibility( layout )
+  visible.isVisibleFrom( ghostPosition, pacmanPosition, Directions.NORTH )
+"""
+
+from game import Actions
+from game import Directions
+import os, sys, struct, array, tempfile
+
+VISIBILITY_CACHE = {} # layout hash -> Visibility
+CACHE_DIRECTORY = os.environ.get( 'PACMAN_CACHE', os.path.join( os.path.expanduser( '~' ), '.cache', 'pacman' ) )
+MAGIC = 'PMVS'
+VERSION = 1
+_PREAMBLE = struct.Struct( '>4sBII' )
+
+class Visibility:
+    """
+    reach[Actions.CODES[direction] * width * height + x * height + y] is
+    the last x (for East and West) or y (for North and South) that can be
+    seen from the open cell (x, y) looking in direction.
+    """
+    def __init__( self, width, height, reach ):
+        self.width = width
+        self.height = height
+        self.reach = reach
+
+    def getReach( self, position, direction ):
+        x, y = [int( i ) for i in position]
+        return self.reach[Actions.CODES[direction] * self.width * self.height + x * self.height + y]
+
+    def isVisibleFrom( self, position, fromPosition, direction ):
+        """
+        Whether position (possibly a half step) can be seen from the cell
+        fromPosition looking in direction.
+        """
+        if direction == Directions.STOP: return False
+        x, y = [int( i ) for i in fromPosition]
+        targetX, targetY = position
+        reach = self.reach[Actions.CODES[direction] * self.width * self.height + x * self.height + y]
+        if direction == Directions.NORTH: return targetX == x and y <= targetY <= reach
+        if direction == Directions.SOUTH: return targetX == x and reach <= targetY <= y
+        if direction == Directions.EAST: return targetY == y and x <= targetX <= reach
+        return targetY == y and reach <= targetX <= x
+
+    def getVisibleCells( self, fromPosition, direction ):
+        """
+        The cells seen from fromPosition looking in direction, nearest first.
+        """
+        if direction == Directions.STOP: return []
+        x, y = [int( i ) for i in fromPosition]
+        reach = self.getReach( fromPosition, direction )
+        dx, dy = [int( i ) for i in Actions.directionToVector( direction )]
+        if dx == 0: steps = abs( reach - y ) + 1
+        else: steps = abs( reach - x ) + 1
+        return [(x + dx * i, y + dy * i) for i in range( steps )]
+
+def computeVisibility( walls ):
+    """
+    Builds the Visibility of the walls Grid with one pass over the cells per
+    direction.
+    """
+    width, height = walls.width, walls.height
+    cells = width * height
+    reach = array.array( 'i', [-1] ) * (4 * cells)
+    north, south, east, west = [Actions.CODES[direction] * cells for direction in
+                                [Directions.NORTH, Directions.SOUTH, Directions.EAST, Directions.WEST]]
+    for x in range( width ):
+        column = walls.data[x]
+        base = x * height
+        top = None
+        for y in range( height - 1, -1, -1 ):
+            if column[y]: top = None
+            else:
+                if top == None: top = y
+                reach[north + base + y] = top
+        bottom = None
+        for y in range( height ):
+            if column[y]: bottom = None
+            else:
+                if bottom == None: bottom = y
+                reach[south + base + y] = bottom
+    for y in range( height ):
+        right = None
+        for x in range( width - 1, -1, -1 ):
+            if walls.data[x][y]: right = None
+            else:
+                if right == None: right = x
+                reach[east + x * height + y] = right
+        left = None
+        for x in range( width ):
+            if walls.data[x][y]: left = None
+            else:
+                if left == None: left = x
+                reach[west + x * height + y] = left
+    return Visibility( width, height, reach )
+
+def cacheFileName( layout ):
+    return os.path.join( CACHE_DIRECTORY, layout.getHash() + '.vis' )
+
+def loadVisibility( fileName, width, height ):
+    """
+    The Visibility saved in fileName, or None if there is no usable one.
+    """
+    if not os.path.exists( fileName ): return None
+    f = open( fileName, 'rb' )
+    try:
+        preamble = f.read( _PREAMBLE.size )
+        if len(preamble) != _PREAMBLE.size: return None
+        if _PREAMBLE.unpack( preamble ) != (MAGIC, VERSION, width, height): return None
+        reach = array.array( 'i' )
+        try: reach.fromfile( f, 4 * width * height )
+        except EOFError: return None
+    finally:
+        f.close()
+    if sys.byteorder != 'little': reach.byteswap()
+    return Visibility( width, height, reach )
+
+def saveVisibility( fileName, visible ):
+    "Saves visible to fileName; does nothing if it cannot be written."
+    temporary = None
+    try:
+        if not os.path.isdir( CACHE_DIRECTORY ): os.makedirs( CACHE_DIRECTORY )
+        handle, temporary = tempfile.mkstemp( '.tmp', os.path.basename( fileName ), os.path.dirname( fileName ) )
+        f = os.fdopen( handle, 'wb' )
+        try:
+            f.write( _PREAMBLE.pack( MAGIC, VERSION, visible.width, visible.height ) )
+            reach = visible.reach
+            if sys.byteorder != 'little':
+                reach = array.array( 'i', reach )
+                reach.byteswap()
+            reach.tofile( f )
+        finally: f.close()
+        os.rename( temporary, fileName )
+    except (IOError, OSError):
+        if temporary != None and os.path.exists( temporary ): os.remove( temporary )
+
+def getVisibility( layout ):
+    """
+    Returns the (cached) Visibility of layout.
+    """
+    key = layout.getHash()
+    if key not in VISIBILITY_CACHE:
+        fileName = cacheFileName( layout )
+        visible = loadVisibility( fileName, layout.width, layout.height )
+        if visible == None:
+            visible = computeVisibility( layout.walls )
+            saveVisibility( fileName, visible )
+        VISIBILITY_CACHE[key] = visible
+    return VISIBILITY_CACHE[key]